@@ -25,6 +25,13 @@ get_registered_models = default_search_engine.get_registered_models
 get_adapter = default_search_engine.get_adapter
 
 
+# Bulk index management.
+update_queryset_index = default_search_engine.update_queryset_index
+update_pks_index = default_search_engine.update_pks_index
+delete_pks_index = default_search_engine.delete_pks_index
+update_live_index = default_search_engine.update_live_index
+
+
 # Easy context management.
 update_index = search_context_manager.update_index
 skip_index_update = search_context_manager.skip_index_update
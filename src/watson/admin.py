@@ -3,8 +3,10 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
-from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.views.main import ChangeList, SEARCH_VAR
+from django.core.paginator import Paginator
 
+from watson.backends import COUNT_EXACT, count_results
 from watson.registration import SearchEngine, SearchAdapter
 
 
@@ -30,6 +32,25 @@ class WatsonSearchChangeList(ChangeList):
         return qs
 
 
+class WatsonSearchPaginator(Paginator):
+
+    """A paginator that counts full text search results using a count strategy."""
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count_strategy=COUNT_EXACT, count_limit=None):
+        """Initializes the paginator."""
+        super(WatsonSearchPaginator, self).__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.count_strategy = count_strategy
+        self.count_limit = count_limit
+        self._result_count = None
+
+    @property
+    def count(self):
+        """Counts the search results using the count strategy."""
+        if self._result_count is None:
+            self._result_count = count_results(self.object_list, self.count_strategy, self.count_limit)
+        return self._result_count
+
+
 class SearchAdmin(admin.ModelAdmin):
 
     """
@@ -43,6 +64,12 @@ class SearchAdmin(admin.ModelAdmin):
 
     search_adapter_cls = SearchAdapter
 
+    # The strategy used to count search results, one of "exact", "capped" or "estimate".
+    search_count_strategy = COUNT_EXACT
+
+    # The number of search results after which capped counts stop, or None for the default.
+    search_count_limit = None
+
     @property
     def search_context_manager(self):
         """The search context manager used by this SearchAdmin."""
@@ -73,6 +100,12 @@ class SearchAdmin(admin.ModelAdmin):
                 get_live_queryset = lambda self_: None,  # Ensure complete queryset is used in admin.
             )
 
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        """Returns the paginator, which counts full text search results using the search count strategy."""
+        if request.GET.get(SEARCH_VAR, "").strip():
+            return WatsonSearchPaginator(queryset, per_page, orphans, allow_empty_first_page, self.search_count_strategy, self.search_count_limit)
+        return super(SearchAdmin, self).get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
     def get_changelist(self, request, **kwargs):
         """Returns the ChangeList class for use on the changelist page."""
         return WatsonSearchChangeList
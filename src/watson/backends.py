@@ -2,12 +2,16 @@
 
 from __future__ import unicode_literals
 
-import re, abc
+import re, abc, io, json, hashlib
 
 from django.contrib.contenttypes.models import ContentType
-from django.db import connection, transaction
+from django.db import connection, models, transaction
 from django.db.models import Q
-from django.utils.encoding import force_text
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.encoding import force_text, python_2_unicode_compatible
 from django.utils import six
 
 from watson.models import SearchEntry, has_int_pk
@@ -29,6 +33,661 @@ def make_escaper(badchars):
     return escaper
 
 
+SEARCH_ENTRY_UNIQUE_INDEX = "watson_searchentry_engine_slug_content_type_id_object_id"
+
+SEARCH_QUEUE_ENTRY_INDEX = "watson_searchqueueentry_engine_slug_content_type_id_object_id"
+
+SEARCH_ENTRY_TSV_INDEX = "watson_searchentry_search_tsv"
+
+SEARCH_ENTRY_KEY_COLUMNS = ("engine_slug", "content_type_id", "object_id",)
+
+SEARCH_ENTRY_DATA_COLUMNS = ("object_id_int", "title", "description", "content", "url", "meta_encoded", "content_hash", "is_live",)
+
+SEARCH_ENTRY_COLUMNS = SEARCH_ENTRY_KEY_COLUMNS + SEARCH_ENTRY_DATA_COLUMNS
+
+# The approximate size of each batch of bulk loaded search entries. This is kept well under
+# the default MySQL max_allowed_packet of 4MB.
+BULK_LOAD_BATCH_BYTES = 1024 * 1024
+
+
+def _has_table(db_table):
+    """Checks whether the given table exists."""
+    return db_table in connection.introspection.table_names()
+
+
+def _has_index(db_table, index_name):
+    """Checks whether the given index is installed on the given table."""
+    if not _has_table(db_table):
+        return False
+    cursor = connection.cursor()
+    if connection.vendor == "postgresql":
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s", (db_table, index_name,))
+    elif connection.vendor == "mysql":
+        cursor.execute("SHOW INDEX FROM {db_table} WHERE Key_name = %s".format(
+            db_table = connection.ops.quote_name(db_table),
+        ), (index_name,))
+    elif connection.vendor == "sqlite":
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = %s", (index_name,))
+    else:
+        return False
+    return bool(cursor.fetchall())
+
+
+def _get_key_index_columns():
+    """Returns the SQL column list of a non-unique (engine_slug, content_type_id, object_id) index."""
+    # MySQL cannot index a whole TEXT column, so index a prefix of the object id instead. This
+    # is only used to find rows, so object ids that share the prefix just match more rows.
+    if connection.vendor == "mysql":
+        return "engine_slug(50), content_type_id, object_id(190)"
+    return "engine_slug, content_type_id, object_id"
+
+
+# MySQL cannot index a whole TEXT column, so its unique index is built on a hash of the key,
+# stored in a generated column that only exists on MySQL.
+SEARCH_ENTRY_KEY_HASH_COLUMN = "object_key_hash"
+
+
+def _get_unique_index_columns():
+    """Returns the SQL column list of the unique (engine_slug, content_type_id, object_id) index."""
+    if connection.vendor == "mysql":
+        return SEARCH_ENTRY_KEY_HASH_COLUMN
+    return "engine_slug, content_type_id, object_id"
+
+
+def _has_key_hash_column():
+    """Checks whether the MySQL search entry table has the column hashing the unique key."""
+    cursor = connection.cursor()
+    cursor.execute("SHOW COLUMNS FROM watson_searchentry WHERE Field = %s", (SEARCH_ENTRY_KEY_HASH_COLUMN,))
+    return bool(cursor.fetchall())
+
+
+def has_unique_index():
+    """Checks whether the unique (engine_slug, content_type_id, object_id) index is installed."""
+    return _has_index("watson_searchentry", SEARCH_ENTRY_UNIQUE_INDEX)
+
+
+def can_upsert():
+    """
+    Checks whether search entries can be upserted, which needs both database support and
+    the unique index. The result is cached on the connection.
+    """
+    can_upsert = getattr(connection, "_watson_can_upsert", None)
+    if can_upsert is None:
+        can_upsert = supports_upsert() and has_unique_index()
+        connection._watson_can_upsert = can_upsert
+    return can_upsert
+
+
+def install_unique_index():
+    """
+    Removes any duplicated search entries, then creates the unique index used to
+    upsert search entries.
+
+    Databases that do not support upserts are left untouched.
+    """
+    if not supports_upsert() or has_unique_index():
+        return
+    cursor = connection.cursor()
+    if connection.vendor == "mysql":
+        # Hash the whole key, since an index on a prefix of the object id would treat object
+        # ids that share the prefix as the same object.
+        if not _has_key_hash_column():
+            cursor.execute("ALTER TABLE watson_searchentry ADD COLUMN {column} BINARY(20) AS (UNHEX(SHA1(CONCAT_WS(CHAR(0), engine_slug, content_type_id, object_id)))) STORED".format(
+                column = SEARCH_ENTRY_KEY_HASH_COLUMN,
+            ))
+    # Remove duplicates, keeping the oldest entry for each object.
+    cursor.execute("""
+        DELETE FROM watson_searchentry WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT MIN(id) AS id FROM watson_searchentry GROUP BY {columns}
+            ) AS watson_searchentry_keep
+        )
+    """.format(
+        columns = _get_unique_index_columns(),
+    ))
+    cursor.execute("CREATE UNIQUE INDEX {index_name} ON watson_searchentry ({columns})".format(
+        index_name = SEARCH_ENTRY_UNIQUE_INDEX,
+        columns = _get_unique_index_columns(),
+    ))
+    connection._watson_can_upsert = None
+
+
+def uninstall_unique_index():
+    """Drops the unique index used to upsert search entries."""
+    if not has_unique_index():
+        return
+    cursor = connection.cursor()
+    if connection.vendor == "mysql":
+        cursor.execute("DROP INDEX {index_name} ON watson_searchentry".format(
+            index_name = SEARCH_ENTRY_UNIQUE_INDEX,
+        ))
+        if _has_key_hash_column():
+            cursor.execute("ALTER TABLE watson_searchentry DROP COLUMN {column}".format(
+                column = SEARCH_ENTRY_KEY_HASH_COLUMN,
+            ))
+    else:
+        cursor.execute("DROP INDEX {index_name}".format(
+            index_name = SEARCH_ENTRY_UNIQUE_INDEX,
+        ))
+    connection._watson_can_upsert = None
+
+
+def has_queue_index():
+    """Checks whether the (engine_slug, content_type_id, object_id) index of the search queue is installed."""
+    return _has_index("watson_searchqueueentry", SEARCH_QUEUE_ENTRY_INDEX)
+
+
+def install_queue_index():
+    """
+    Creates the index used to find the queued updates for an object.
+    
+    Nothing is done until the search queue table exists, since the migration that creates
+    it installs the index itself.
+    """
+    if not _has_table("watson_searchqueueentry") or has_queue_index():
+        return
+    connection.cursor().execute("CREATE INDEX {index_name} ON watson_searchqueueentry ({columns})".format(
+        index_name = SEARCH_QUEUE_ENTRY_INDEX,
+        columns = _get_key_index_columns(),
+    ))
+
+
+def uninstall_queue_index():
+    """Drops the index used to find the queued updates for an object."""
+    if not has_queue_index():
+        return
+    if connection.vendor == "mysql":
+        sql = "DROP INDEX {index_name} ON watson_searchqueueentry"
+    else:
+        sql = "DROP INDEX {index_name}"
+    connection.cursor().execute(sql.format(
+        index_name = SEARCH_QUEUE_ENTRY_INDEX,
+    ))
+
+
+SEARCH_ENTRY_SHADOW_TABLE = "watson_searchentry_shadow"
+
+# The temporary table that bulk loaded search entries are copied into, so that computed
+# columns can be filled in as they are inserted.
+SEARCH_ENTRY_LOAD_TABLE = "watson_searchentry_load"
+
+# The SQLite FTS5 index of the search entry table.
+SEARCH_ENTRY_FTS_TABLE = "watson_searchentry_fts"
+
+
+def _get_shadow_name(name):
+    """Returns a name for the shadow copy of the given index or constraint, within PostgreSQL's 63 character limit."""
+    return "{name}_{hash}".format(
+        name = name[:50],
+        hash = hashlib.md5(name.encode("utf-8")).hexdigest()[:8],
+    )
+
+
+def drop_shadow_table():
+    """Drops the shadow search entry table, if it exists."""
+    connection.cursor().execute("DROP TABLE IF EXISTS {shadow_table}".format(
+        shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE),
+    ))
+
+
+def create_shadow_table():
+    """
+    Creates an empty copy of the search entry table, ready to be bulk loaded and then
+    swapped in by swap_shadow_table.
+    
+    Where possible, the copy is created without indexes, so they can be built once the
+    copy is loaded.
+    """
+    drop_shadow_table()
+    cursor = connection.cursor()
+    table = SearchEntry._meta.db_table
+    if connection.vendor == "postgresql":
+        cursor.execute("CREATE TABLE {shadow_table} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS{including_generated})".format(
+            shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE),
+            table = connection.ops.quote_name(table),
+            including_generated = " INCLUDING GENERATED" if connection.pg_version >= 120000 else "",
+        ))
+        # Copy the triggers, such as the one that maintains the search_tsv column.
+        cursor.execute("SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal", (table,))
+        for trigger_sql, in cursor.fetchall():
+            cursor.execute(re.sub(r" ON (\S+) ", " ON {shadow_table} ".format(
+                shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE),
+            ), trigger_sql, count=1))
+    elif connection.vendor == "mysql":
+        # MySQL copies the indexes along with the table.
+        cursor.execute("CREATE TABLE {shadow_table} LIKE {table}".format(
+            shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE),
+            table = connection.ops.quote_name(table),
+        ))
+    elif connection.vendor == "sqlite":
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+        table_sql = cursor.fetchone()[0]
+        cursor.execute(re.sub(r"^CREATE TABLE\s+(\S+)", "CREATE TABLE {shadow_table}".format(
+            shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE),
+        ), table_sql, count=1))
+    else:
+        raise NotImplementedError("Shadow tables are not supported by the {vendor} database".format(
+            vendor = connection.vendor,
+        ))
+
+
+def swap_shadow_table():
+    """
+    Builds the indexes of the shadow search entry table, then replaces the search entry
+    table with it. The old search entry table is dropped.
+    
+    On MySQL, CREATE TABLE and RENAME TABLE implicitly commit the current transaction, so
+    the shadow table is not created, loaded and swapped in a single transaction there.
+    """
+    cursor = connection.cursor()
+    table = SearchEntry._meta.db_table
+    quoted_table = connection.ops.quote_name(table)
+    quoted_shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE)
+    if connection.vendor == "postgresql":
+        # Build the indexes and constraints under temporary names.
+        cursor.execute("SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')", (table,))
+        constraints = cursor.fetchall()
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s", (table,))
+        constraint_names = set(constraint_name for constraint_name, _, _ in constraints)
+        indexes = [(index_name, index_sql) for index_name, index_sql in cursor.fetchall() if index_name not in constraint_names]
+        for index_name, index_sql in indexes:
+            cursor.execute(re.sub(r"^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON (?:ONLY )?)(\S+)", lambda match: "{create}{index_name}{on}{shadow_table}".format(
+                create = match.group(1),
+                index_name = connection.ops.quote_name(_get_shadow_name(index_name)),
+                on = match.group(3),
+                shadow_table = quoted_shadow_table,
+            ), index_sql, count=1))
+        for constraint_name, _, constraint_sql in constraints:
+            cursor.execute("ALTER TABLE {shadow_table} ADD CONSTRAINT {constraint_name} {constraint_sql}".format(
+                shadow_table = quoted_shadow_table,
+                constraint_name = connection.ops.quote_name(_get_shadow_name(constraint_name)),
+                constraint_sql = constraint_sql,
+            ))
+        # Keep the id sequence, which is owned by the old table.
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+        sequence_name = cursor.fetchone()[0]
+        if sequence_name:
+            cursor.execute("ALTER SEQUENCE {sequence_name} OWNED BY {shadow_table}.id".format(
+                sequence_name = sequence_name,
+                shadow_table = quoted_shadow_table,
+            ))
+        # Swap the tables, and restore the original names.
+        cursor.execute("DROP TABLE {table}".format(table=quoted_table))
+        cursor.execute("ALTER TABLE {shadow_table} RENAME TO {table}".format(
+            shadow_table = quoted_shadow_table,
+            table = quoted_table,
+        ))
+        for index_name, _ in indexes:
+            cursor.execute("ALTER INDEX {shadow_index_name} RENAME TO {index_name}".format(
+                shadow_index_name = connection.ops.quote_name(_get_shadow_name(index_name)),
+                index_name = connection.ops.quote_name(index_name),
+            ))
+        for constraint_name, _, _ in constraints:
+            cursor.execute("ALTER TABLE {table} RENAME CONSTRAINT {shadow_constraint_name} TO {constraint_name}".format(
+                table = quoted_table,
+                shadow_constraint_name = connection.ops.quote_name(_get_shadow_name(constraint_name)),
+                constraint_name = connection.ops.quote_name(constraint_name),
+            ))
+    elif connection.vendor == "mysql":
+        old_table = connection.ops.quote_name(table + "_old")
+        cursor.execute("DROP TABLE IF EXISTS {old_table}".format(old_table=old_table))
+        cursor.execute("RENAME TABLE {table} TO {old_table}, {shadow_table} TO {table}".format(
+            table = quoted_table,
+            old_table = old_table,
+            shadow_table = quoted_shadow_table,
+        ))
+        cursor.execute("DROP TABLE {old_table}".format(old_table=old_table))
+    elif connection.vendor == "sqlite":
+        # SQLite drops the indexes and triggers along with the old table, so recreate them afterwards.
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = %s AND sql IS NOT NULL ORDER BY type", (table,))
+        schema_sqls = [schema_sql for schema_sql, in cursor.fetchall()]
+        cursor.execute("DROP TABLE {table}".format(table=quoted_table))
+        cursor.execute("ALTER TABLE {shadow_table} RENAME TO {table}".format(
+            shadow_table = quoted_shadow_table,
+            table = quoted_table,
+        ))
+        for schema_sql in schema_sqls:
+            cursor.execute(schema_sql)
+        # Rebuild the FTS5 index, which still refers to the rows of the old table.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (SEARCH_ENTRY_FTS_TABLE,))
+        if cursor.fetchall():
+            cursor.execute("INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')".format(
+                fts_table = connection.ops.quote_name(SEARCH_ENTRY_FTS_TABLE),
+            ))
+    else:
+        raise NotImplementedError("Shadow tables are not supported by the {vendor} database".format(
+            vendor = connection.vendor,
+        ))
+
+
+def supports_upsert():
+    """
+    Checks whether the database can create or update a batch of search entries in a single statement.
+    
+    MySQL needs stored generated columns, added in MySQL 5.7.6, to key the unique index on
+    a hash of the whole object id.
+    """
+    if connection.vendor == "postgresql":
+        return connection.pg_version >= 90500
+    if connection.vendor == "mysql":
+        return connection.mysql_version >= (5, 7, 6)
+    return connection.vendor == "sqlite"
+
+
+def supports_window_functions():
+    """Checks whether the database supports window functions, such as ROW_NUMBER() OVER (...)."""
+    if connection.vendor == "postgresql":
+        return True
+    if connection.vendor == "mysql":
+        return connection.mysql_version >= (8, 0, 2)
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 25, 0)
+    return False
+
+
+def bulk_upsert_search_entries(search_entries):
+    """
+    Creates or updates the given search entries in a single statement, keyed on the
+    unique (engine_slug, content_type_id, object_id) index.
+    """
+    columns = SEARCH_ENTRY_COLUMNS
+    # Respect any limit on the number of query parameters, such as SQLite's.
+    batch_size = connection.ops.bulk_batch_size(columns, search_entries)
+    if len(search_entries) > batch_size:
+        bulk_upsert_search_entries(search_entries[:batch_size])
+        bulk_upsert_search_entries(search_entries[batch_size:])
+        return
+    row_sql = "({placeholders})".format(
+        placeholders = ", ".join(["%s"] * len(columns)),
+    )
+    sql = "INSERT INTO {db_table} ({columns}) VALUES {rows}".format(
+        db_table = connection.ops.quote_name(SearchEntry._meta.db_table),
+        columns = ", ".join(connection.ops.quote_name(column) for column in columns),
+        rows = ", ".join([row_sql] * len(search_entries)),
+    )
+    if connection.vendor == "postgresql" or (connection.vendor == "sqlite" and connection.Database.sqlite_version_info >= (3, 24, 0)):
+        # Update rows in place, firing update triggers, such as the ones that maintain the FTS5 index.
+        sql += " ON CONFLICT ({key_columns}) DO UPDATE SET {updates}".format(
+            key_columns = ", ".join(connection.ops.quote_name(column) for column in SEARCH_ENTRY_KEY_COLUMNS),
+            updates = ", ".join(
+                "{column} = EXCLUDED.{column}".format(column=connection.ops.quote_name(column))
+                for column in SEARCH_ENTRY_DATA_COLUMNS
+            ),
+        )
+    elif connection.vendor == "mysql":
+        sql += " ON DUPLICATE KEY UPDATE {updates}".format(
+            updates = ", ".join(
+                "{column} = VALUES({column})".format(column=connection.ops.quote_name(column))
+                for column in SEARCH_ENTRY_DATA_COLUMNS
+            ),
+        )
+    else:
+        # Older SQLite has no upserts. INSERT OR REPLACE would not fire the delete triggers that
+        # maintain the FTS5 index, so delete the existing rows first.
+        connection.cursor().execute("DELETE FROM {db_table} WHERE {conditions}".format(
+            db_table = connection.ops.quote_name(SearchEntry._meta.db_table),
+            conditions = " OR ".join(["({key_conditions})".format(
+                key_conditions = " AND ".join(
+                    "{column} = %s".format(column=connection.ops.quote_name(column))
+                    for column in SEARCH_ENTRY_KEY_COLUMNS
+                ),
+            )] * len(search_entries)),
+        ), [
+            getattr(search_entry, column)
+            for search_entry in search_entries
+            for column in SEARCH_ENTRY_KEY_COLUMNS
+        ])
+    params = []
+    for search_entry in search_entries:
+        params.extend(getattr(search_entry, column) for column in columns)
+    connection.cursor().execute(sql, params)
+
+
+def _iter_row_batches(rows, batch_bytes):
+    """Splits the given rows into batches of roughly the given payload size."""
+    batch = []
+    batch_size = 0
+    for row in rows:
+        batch.append(row)
+        batch_size += sum(len(value) if isinstance(value, six.string_types) else 8 for value in row)
+        if batch_size >= batch_bytes:
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+
+def _escape_copy_value(value):
+    """Escapes the given value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    return force_text(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def bulk_load_search_entries(rows, db_table=None, batch_bytes=BULK_LOAD_BATCH_BYTES, backend=None):
+    """
+    Inserts the given search entries, given as tuples of SEARCH_ENTRY_COLUMNS, streaming
+    them to the database in batches of roughly batch_bytes. Returns the number of rows loaded.
+    
+    PostgreSQL uses COPY FROM STDIN, and other databases use executemany, which MySQLdb
+    rewrites into multi-row inserts. Existing search entries are not updated, so this
+    should only be used to load search entries that have been cleared.
+    
+    If given a search backend, any columns it computes while bulk loading are filled in as
+    the rows are inserted, which PostgreSQL does by copying each batch into a temporary table.
+    """
+    load_columns = backend.get_bulk_load_columns() if backend is not None and connection.vendor == "postgresql" else {}
+    db_table = connection.ops.quote_name(db_table or SearchEntry._meta.db_table)
+    load_table = connection.ops.quote_name(SEARCH_ENTRY_LOAD_TABLE)
+    columns = ", ".join(connection.ops.quote_name(column) for column in SEARCH_ENTRY_COLUMNS)
+    cursor = connection.cursor()
+    if load_columns:
+        cursor.execute("DROP TABLE IF EXISTS {load_table}".format(
+            load_table = load_table,
+        ))
+        cursor.execute("CREATE TEMPORARY TABLE {load_table} AS SELECT {columns} FROM {db_table} WITH NO DATA".format(
+            load_table = load_table,
+            columns = columns,
+            db_table = db_table,
+        ))
+    row_count = 0
+    for batch in _iter_row_batches(rows, batch_bytes):
+        if connection.vendor == "postgresql":
+            data = "".join(
+                "\t".join(_escape_copy_value(value) for value in row) + "\n"
+                for row in batch
+            )
+            cursor.copy_expert("COPY {db_table} ({columns}) FROM STDIN".format(
+                db_table = load_table if load_columns else db_table,
+                columns = columns,
+            ), io.BytesIO(data.encode("utf-8")))
+            if load_columns:
+                cursor.execute("INSERT INTO {db_table} ({columns}, {load_columns}) SELECT {columns}, {load_sqls} FROM {load_table}".format(
+                    db_table = db_table,
+                    columns = columns,
+                    load_columns = ", ".join(connection.ops.quote_name(column) for column in load_columns),
+                    load_sqls = ", ".join(load_columns.values()),
+                    load_table = load_table,
+                ))
+                cursor.execute("TRUNCATE {load_table}".format(
+                    load_table = load_table,
+                ))
+        else:
+            cursor.executemany("INSERT INTO {db_table} ({columns}) VALUES ({placeholders})".format(
+                db_table = db_table,
+                columns = columns,
+                placeholders = ", ".join(["%s"] * len(SEARCH_ENTRY_COLUMNS)),
+            ), batch)
+        row_count += len(batch)
+    if load_columns:
+        cursor.execute("DROP TABLE {load_table}".format(
+            load_table = load_table,
+        ))
+    return row_count
+
+
+def delete_search_entries(engine_slug, content_type_id, object_ids, db_table=None):
+    """
+    Deletes the search entries for the given object ids of a content type, from db_table
+    if given rather than the search entry table. Returns the number of rows deleted.
+    """
+    object_ids = [force_text(object_id) for object_id in object_ids]
+    if not object_ids:
+        return 0
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM {db_table} WHERE engine_slug = %s AND content_type_id = %s AND object_id IN ({placeholders})".format(
+        db_table = connection.ops.quote_name(db_table or SearchEntry._meta.db_table),
+        placeholders = ", ".join(["%s"] * len(object_ids)),
+    ), [engine_slug, content_type_id] + object_ids)
+    return cursor.rowcount
+
+
+def lock_search_entry_table():
+    """
+    Blocks writes to the search entry table until the end of the current transaction, where
+    the database supports it, so that they wait for a shadow table to be swapped in.
+    
+    SQLite already serializes writes, and MySQL cannot lock a table without ending the transaction.
+    """
+    if connection.vendor == "postgresql":
+        connection.cursor().execute("LOCK TABLE {table} IN SHARE MODE".format(
+            table = connection.ops.quote_name(SearchEntry._meta.db_table),
+        ))
+
+
+def get_object_id_sql(column_sql, model):
+    """
+    Returns SQL that converts the given primary key column of the given model into the text
+    stored in SearchEntry.object_id, so that object ids can be matched without loading them.
+    """
+    pk = model._meta.pk
+    while isinstance(pk, models.ForeignKey):
+        pk = pk.rel.to._meta.pk
+    # Text primary keys are stored as they are.
+    if isinstance(pk, (models.CharField, models.TextField)):
+        return column_sql
+    # UUIDs are stored as hex without hyphens, except on PostgreSQL.
+    if pk.get_internal_type() == "UUIDField" and connection.vendor != "postgresql":
+        parts = [
+            "SUBSTR({column_sql}, {start}, {length})".format(
+                column_sql = column_sql,
+                start = start,
+                length = length,
+            )
+            for start, length
+            in ((1, 8), (9, 4), (13, 4), (17, 4), (21, 12))
+        ]
+        if connection.vendor == "mysql":
+            return "CONCAT_WS('-', {parts})".format(
+                parts = ", ".join(parts),
+            )
+        return " || '-' || ".join(parts)
+    # Everything else is cast to text.
+    if connection.vendor == "mysql":
+        return "CAST({column_sql} AS CHAR)".format(
+            column_sql = column_sql,
+        )
+    return "CAST({column_sql} AS TEXT)".format(
+        column_sql = column_sql,
+    )
+
+
+# The strategies for counting search results.
+COUNT_EXACT = "exact"
+
+COUNT_CAPPED = "capped"
+
+COUNT_ESTIMATE = "estimate"
+
+COUNT_STRATEGIES = (COUNT_EXACT, COUNT_CAPPED, COUNT_ESTIMATE,)
+
+# The number of search results after which capped counts stop counting.
+COUNT_LIMIT = 10000
+
+
+@python_2_unicode_compatible
+class ResultCount(int):
+
+    """
+    A count of search results, made using one of the count strategies.
+    
+    Capped counts are shown as "10000+", and estimated counts as "~123456".
+    """
+    
+    def __new__(cls, count, count_strategy=COUNT_EXACT):
+        """Creates the result count."""
+        result_count = super(ResultCount, cls).__new__(cls, count)
+        result_count.count_strategy = count_strategy
+        return result_count
+    
+    @property
+    def is_exact(self):
+        """Whether this is the exact number of search results."""
+        return self.count_strategy == COUNT_EXACT
+    
+    def __str__(self):
+        """Returns the count, marked if it is not exact."""
+        if self.count_strategy == COUNT_CAPPED:
+            return "{count}+".format(count=int(self))
+        if self.count_strategy == COUNT_ESTIMATE:
+            return "~{count}".format(count=int(self))
+        return "{count}".format(count=int(self))
+
+
+def _count_capped(queryset, count_limit):
+    """Counts the results of the given queryset, scanning no more than count_limit + 1 rows."""
+    sql, params = queryset.order_by().values_list("pk", flat=True)[:count_limit + 1].query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM ({sql}) watson_capped_count".format(
+        sql = sql,
+    ), params)
+    return cursor.fetchone()[0]
+
+
+def _count_estimate(queryset):
+    """Returns the PostgreSQL query planner's estimate of the number of results of the given queryset."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute("EXPLAIN (FORMAT JSON) {sql}".format(
+        sql = sql,
+    ), params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, six.string_types):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_results(queryset, count_strategy=COUNT_EXACT, count_limit=None):
+    """
+    Counts the results of the given queryset, returning a ResultCount.
+    
+    Capped counts stop scanning after count_limit results, which defaults to COUNT_LIMIT.
+    Estimated counts use the query planner on PostgreSQL, falling back to a capped count
+    for small or unsupported searches.
+    """
+    if count_limit is None:
+        count_limit = COUNT_LIMIT
+    if count_strategy not in COUNT_STRATEGIES:
+        raise ValueError("Unknown count strategy {count_strategy!r}. Expected one of {count_strategies!r}".format(
+            count_strategy = count_strategy,
+            count_strategies = COUNT_STRATEGIES,
+        ))
+    if count_strategy == COUNT_EXACT:
+        return ResultCount(queryset.count())
+    try:
+        if count_strategy == COUNT_ESTIMATE and connection.vendor == "postgresql":
+            count = _count_estimate(queryset)
+            if count > count_limit:
+                return ResultCount(count, COUNT_ESTIMATE)
+        count = _count_capped(queryset, count_limit)
+    except EmptyResultSet:
+        return ResultCount(0)
+    if count > count_limit:
+        return ResultCount(count_limit, COUNT_CAPPED)
+    return ResultCount(count)
+
+
 class SearchBackend(six.with_metaclass(abc.ABCMeta)):
 
     """Base class for all search backends."""
@@ -45,6 +704,30 @@ class SearchBackend(six.with_metaclass(abc.ABCMeta)):
         """Executes the SQL needed to uninstall django-watson."""
         pass
     
+    def begin_bulk_load(self, db_table, drop_indexes=False):
+        """
+        Prepares the given search entry table, or copy of it, for search entries to be bulk
+        loaded into it by bulk_load_search_entries in the current transaction.
+        
+        If drop_indexes is set, most of the table is about to be reloaded, so the backend may
+        drop indexes that are cheaper to rebuild afterwards than to update row by row.
+        """
+        pass
+    
+    def get_bulk_load_columns(self):
+        """
+        Returns a dict of the columns that bulk_load_search_entries should compute while bulk
+        loading, mapped to SQL expressions of the loaded columns.
+        """
+        return {}
+    
+    def end_bulk_load(self, db_table, drop_indexes=False):
+        """
+        Finishes bulk loading search entries into the given search entry table, or copy of it,
+        rebuilding any indexes dropped by begin_bulk_load.
+        """
+        pass
+    
     requires_installation = False
     
     supports_ranking = False
@@ -57,6 +740,36 @@ class SearchBackend(six.with_metaclass(abc.ABCMeta)):
             select = {
                 "watson_rank": "1",
             },
+            order_by = ("id",),
+        )
+        
+    def do_search_seek(self, engine_slug, queryset, search_text, rank, pk):
+        """Restricts the given ranked queryset to the results ranked after the given rank and search entry id."""
+        return queryset.filter(
+            id__gt = pk,
+        )
+        
+    def get_search_candidate_order_sql(self, search_text):
+        """
+        Returns the SQL and params of a cheap ordering for the first pass of two-phase
+        ranking, which picks the search entries that are ranked in full.
+        """
+        return "watson_searchentry.id", ()
+        
+    def do_search_candidates(self, engine_slug, queryset, search_text, candidate_limit):
+        """
+        Restricts the given queryset to the first candidate_limit search entries in the cheap
+        first-pass ordering, so that only they are ranked.
+        """
+        candidate_sql, candidate_params = queryset.order_by().values_list("id", flat=True).query.sql_with_params()
+        order_sql, order_params = self.get_search_candidate_order_sql(search_text)
+        return queryset.extra(
+            where = ("watson_searchentry.id IN (SELECT id FROM ({candidate_sql} ORDER BY {order_sql} LIMIT {candidate_limit}) watson_candidates)".format(
+                candidate_sql = candidate_sql,
+                order_sql = order_sql,
+                candidate_limit = int(candidate_limit),
+            ),),
+            params = tuple(candidate_params) + tuple(order_params),
         )
         
     @abc.abstractmethod
@@ -164,6 +877,25 @@ class PostgresSearchBackend(SearchBackend):
     search_config = "pg_catalog.english"
     """Text search configuration to use in `to_tsvector` and `to_tsquery` functions"""
 
+    use_generated_column = False
+    """Whether search_tsv is a generated column, rather than maintained by a trigger. Requires PostgreSQL 12+"""
+    
+    def get_search_tsv_sql(self, prefix=""):
+        """
+        Returns the SQL expression used to compute search_tsv, using columns with the given prefix.
+        
+        The text search configuration is cast to regconfig, so the expression is immutable and
+        can be used in a generated column.
+        """
+        return """
+            setweight(to_tsvector('{search_config}'::regconfig, coalesce({prefix}title, '')), 'A') ||
+            setweight(to_tsvector('{search_config}'::regconfig, coalesce({prefix}description, '')), 'C') ||
+            setweight(to_tsvector('{search_config}'::regconfig, coalesce({prefix}content, '')), 'D')
+        """.format(
+            search_config = self.search_config,
+            prefix = prefix,
+        )
+
     def escape_postgres_query(self, text):
         """Escapes the given text to become a valid ts_query."""
         return " & ".join(
@@ -208,17 +940,14 @@ class PostgresSearchBackend(SearchBackend):
             -- Create the trigger function.
             CREATE OR REPLACE FUNCTION watson_searchentry_trigger_handler() RETURNS trigger AS $$
             begin
-                new.search_tsv :=
-                    setweight(to_tsvector('{search_config}', coalesce(new.title, '')), 'A') ||
-                    setweight(to_tsvector('{search_config}', coalesce(new.description, '')), 'C') ||
-                    setweight(to_tsvector('{search_config}', coalesce(new.content, '')), 'D');
+                new.search_tsv := {search_tsv_sql};
                 return new;
             end
             $$ LANGUAGE plpgsql;
             CREATE TRIGGER watson_searchentry_trigger BEFORE INSERT OR UPDATE
             ON watson_searchentry FOR EACH ROW EXECUTE PROCEDURE watson_searchentry_trigger_handler();
         """.format(
-            search_config = self.search_config
+            search_tsv_sql = self.get_search_tsv_sql("new."),
         ))
 
     @transaction.atomic()
@@ -231,6 +960,46 @@ class PostgresSearchBackend(SearchBackend):
 
             DROP FUNCTION watson_searchentry_trigger_handler();
         """)
+    
+    def begin_bulk_load(self, db_table, drop_indexes=False):
+        """
+        Suspends the search_tsv trigger, since bulk_load_search_entries computes search_tsv as
+        the rows are inserted.
+        
+        The trigger stays enabled for other connections, whose writes wait for the transaction.
+        If drop_indexes is set, the search_tsv index is dropped too, since building it once is
+        much faster than updating it row by row, but searches then wait for the transaction.
+        """
+        cursor = connection.cursor()
+        if drop_indexes and _has_index(db_table, SEARCH_ENTRY_TSV_INDEX):
+            cursor.execute("DROP INDEX {index_name}".format(
+                index_name = connection.ops.quote_name(SEARCH_ENTRY_TSV_INDEX),
+            ))
+        if self.use_generated_column:
+            return
+        cursor.execute("ALTER TABLE {db_table} DISABLE TRIGGER watson_searchentry_trigger".format(
+            db_table = connection.ops.quote_name(db_table),
+        ))
+    
+    def get_bulk_load_columns(self):
+        """Computes search_tsv while bulk loading, unless it is a generated column."""
+        if self.use_generated_column:
+            return {}
+        return {"search_tsv": self.get_search_tsv_sql()}
+    
+    def end_bulk_load(self, db_table, drop_indexes=False):
+        """Restores the search_tsv trigger, and rebuilds the search_tsv index if it was dropped."""
+        cursor = connection.cursor()
+        if drop_indexes and not _has_index(db_table, SEARCH_ENTRY_TSV_INDEX):
+            cursor.execute("CREATE INDEX {index_name} ON {db_table} USING gin(search_tsv)".format(
+                index_name = connection.ops.quote_name(SEARCH_ENTRY_TSV_INDEX),
+                db_table = connection.ops.quote_name(db_table),
+            ))
+        if self.use_generated_column:
+            return
+        cursor.execute("ALTER TABLE {db_table} ENABLE TRIGGER watson_searchentry_trigger".format(
+            db_table = connection.ops.quote_name(db_table),
+        ))
         
     requires_installation = True
     
@@ -247,16 +1016,46 @@ class PostgresSearchBackend(SearchBackend):
             params = (self.escape_postgres_query(search_text),),
         )
         
+    def get_search_rank_sql(self):
+        """Returns the SQL expression used to rank search entries."""
+        return "ts_rank_cd(watson_searchentry.search_tsv, to_tsquery('{search_config}', %s))".format(
+            search_config = self.search_config
+        )
+        
     def do_search_ranking(self, engine_slug, queryset, search_text):
         """Performs full text ranking."""
         return queryset.extra(
             select = {
-                "watson_rank": "ts_rank_cd(watson_searchentry.search_tsv, to_tsquery('{search_config}', %s))".format(
-                    search_config = self.search_config
-                ),
+                "watson_rank": self.get_search_rank_sql(),
             },
             select_params = (self.escape_postgres_query(search_text),),
-            order_by = ("-watson_rank",),
+            order_by = ("-watson_rank", "id",),
+        )
+        
+    def escape_postgres_title_query(self, text):
+        """Escapes the given text to become a valid ts_query, only matching search entry titles."""
+        return " & ".join(
+            "{0}A".format(term) if ":" in term else "{0}:A".format(term)
+            for term
+            in self.escape_postgres_query(text).split(" & ")
+            if term
+        )
+        
+    def get_search_candidate_order_sql(self, search_text):
+        """Orders the candidates for full ranking by whether their titles match."""
+        return "(watson_searchentry.search_tsv @@ to_tsquery('{search_config}', %s)) DESC, watson_searchentry.id".format(
+            search_config = self.search_config,
+        ), (self.escape_postgres_title_query(search_text),)
+        
+    def do_search_seek(self, engine_slug, queryset, search_text, rank, pk):
+        """Performs a keyset seek past the given rank and search entry id."""
+        # Compare ranks at their stored precision, so that they round-trip exactly.
+        search_text = self.escape_postgres_query(search_text)
+        return queryset.extra(
+            where = ("({rank}::real < %s::real OR ({rank}::real = %s::real AND watson_searchentry.id > %s))".format(
+                rank = self.get_search_rank_sql(),
+            ),),
+            params = (search_text, rank, search_text, rank, pk),
         )
         
     def do_filter(self, engine_slug, queryset, search_text):
@@ -298,6 +1097,35 @@ class PostgresSearchBackend(SearchBackend):
         )
         
         
+class PostgresGeneratedSearchBackend(PostgresSearchBackend):
+
+    """
+    A search backend that uses native PostgreSQL full text indices, with search_tsv
+    maintained as a generated column instead of by a trigger.
+    
+    This backend works with PostgreSQL 12 and above.
+    """
+    
+    use_generated_column = True
+    
+    @transaction.atomic()
+    def do_install(self):
+        """Executes the PostgreSQL specific SQL code to install django-watson."""
+        connection.cursor().execute("""
+            ALTER TABLE watson_searchentry ADD COLUMN search_tsv tsvector GENERATED ALWAYS AS ({search_tsv_sql}) STORED;
+            CREATE INDEX watson_searchentry_search_tsv ON watson_searchentry USING gin(search_tsv);
+        """.format(
+            search_tsv_sql = self.get_search_tsv_sql(),
+        ))
+    
+    @transaction.atomic()
+    def do_uninstall(self):
+        """Executes the PostgreSQL specific SQL code to uninstall django-watson."""
+        connection.cursor().execute("""
+            ALTER TABLE watson_searchentry DROP COLUMN search_tsv;
+        """)
+
+
 class PostgresLegacySearchBackend(PostgresSearchBackend):
 
     """
@@ -385,19 +1213,37 @@ class MySQLSearchBackend(SearchBackend):
             params = (self._format_query(search_text),),
         )
         
+    def get_search_rank_sql(self):
+        """Returns the SQL expression used to rank search entries."""
+        return """
+            ((MATCH (title) AGAINST (%s IN BOOLEAN MODE)) * 3) +
+            ((MATCH (description) AGAINST (%s IN BOOLEAN MODE)) * 2) +
+            ((MATCH (content) AGAINST (%s IN BOOLEAN MODE)) * 1)
+        """
+        
     def do_search_ranking(self, engine_slug, queryset, search_text):
         """Performs full text ranking."""
         search_text = self._format_query(search_text)
         return queryset.extra(
             select = {
-                "watson_rank": """
-                    ((MATCH (title) AGAINST (%s IN BOOLEAN MODE)) * 3) +
-                    ((MATCH (description) AGAINST (%s IN BOOLEAN MODE)) * 2) +
-                    ((MATCH (content) AGAINST (%s IN BOOLEAN MODE)) * 1)
-                """,
+                "watson_rank": self.get_search_rank_sql(),
             },
             select_params = (search_text, search_text, search_text,),
-            order_by = ("-watson_rank",),
+            order_by = ("-watson_rank", "id",),
+        )
+        
+    def get_search_candidate_order_sql(self, search_text):
+        """Orders the candidates for full ranking by their title relevance."""
+        return "MATCH (title) AGAINST (%s IN BOOLEAN MODE) DESC, watson_searchentry.id", (self._format_query(search_text),)
+        
+    def do_search_seek(self, engine_slug, queryset, search_text, rank, pk):
+        """Performs a keyset seek past the given rank and search entry id."""
+        search_text = self._format_query(search_text)
+        return queryset.extra(
+            where = ("(({rank}) < %s OR (({rank}) = %s AND watson_searchentry.id > %s))".format(
+                rank = self.get_search_rank_sql(),
+            ),),
+            params = (search_text, search_text, search_text, rank, search_text, search_text, search_text, rank, pk),
         )
         
     def do_filter(self, engine_slug, queryset, search_text):
@@ -440,6 +1286,199 @@ class MySQLSearchBackend(SearchBackend):
         )
 
 
+def escape_sqlite_fts5_query(search_text):
+    """Escapes the given text to become a valid FTS5 query, prefix matching each word."""
+    return " ".join(
+        "\"{word}\"*".format(word = word.replace("\"", "\"\""))
+        for word in search_text.split()
+    )
+
+
+class Sqlite3FTS5SearchBackend(SearchBackend):
+
+    """
+    A search backend that uses an SQLite FTS5 full text index.
+    
+    The index is an external content table, kept in sync with the search entry table by
+    triggers, and results are ranked using bm25() weighted by field.
+    """
+    
+    supports_prefix_matching = True
+    
+    requires_installation = True
+    
+    supports_ranking = True
+    
+    title_weight = 3.0
+    
+    description_weight = 2.0
+    
+    content_weight = 1.0
+    
+    def is_installed(self):
+        """Checks whether django-watson is installed."""
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (SEARCH_ENTRY_FTS_TABLE,))
+        return bool(cursor.fetchall())
+    
+    def do_install(self):
+        """Executes the SQLite specific SQL code to install django-watson."""
+        cursor = connection.cursor()
+        format_kwargs = {
+            "fts_table": connection.ops.quote_name(SEARCH_ENTRY_FTS_TABLE),
+            "table": connection.ops.quote_name(SearchEntry._meta.db_table),
+        }
+        # Create the search index, with prefix indexes for short prefixes.
+        cursor.execute("""
+            CREATE VIRTUAL TABLE {fts_table} USING fts5(
+                title, description, content,
+                content = {table}, content_rowid = 'id', prefix = '2 3'
+            )
+        """.format(**format_kwargs))
+        # Create the triggers that keep the search index in sync.
+        cursor.execute("""
+            CREATE TRIGGER watson_searchentry_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts_table} (rowid, title, description, content) VALUES (new.id, new.title, new.description, new.content);
+            END
+        """.format(**format_kwargs))
+        cursor.execute("""
+            CREATE TRIGGER watson_searchentry_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, title, description, content) VALUES ('delete', old.id, old.title, old.description, old.content);
+            END
+        """.format(**format_kwargs))
+        cursor.execute("""
+            CREATE TRIGGER watson_searchentry_fts_update AFTER UPDATE OF title, description, content ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, title, description, content) VALUES ('delete', old.id, old.title, old.description, old.content);
+                INSERT INTO {fts_table} (rowid, title, description, content) VALUES (new.id, new.title, new.description, new.content);
+            END
+        """.format(**format_kwargs))
+        # Index any existing search entries.
+        cursor.execute("INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')".format(**format_kwargs))
+    
+    def do_uninstall(self):
+        """Executes the SQL needed to uninstall django-watson."""
+        cursor = connection.cursor()
+        cursor.execute("DROP TRIGGER IF EXISTS watson_searchentry_fts_insert")
+        cursor.execute("DROP TRIGGER IF EXISTS watson_searchentry_fts_delete")
+        cursor.execute("DROP TRIGGER IF EXISTS watson_searchentry_fts_update")
+        cursor.execute("DROP TABLE {fts_table}".format(
+            fts_table = connection.ops.quote_name(SEARCH_ENTRY_FTS_TABLE),
+        ))
+    
+    def get_search_rank_sql(self):
+        """Returns the SQL expression used to rank search entries."""
+        return "-bm25({fts_table}, {title_weight}, {description_weight}, {content_weight})".format(
+            fts_table = connection.ops.quote_name(SEARCH_ENTRY_FTS_TABLE),
+            title_weight = float(self.title_weight),
+            description_weight = float(self.description_weight),
+            content_weight = float(self.content_weight),
+        )
+    
+    def _get_match_sql(self):
+        """Returns the SQL that joins the search index to the search entries, and matches the search text."""
+        return (
+            "{fts_table}.rowid = watson_searchentry.id".format(
+                fts_table = connection.ops.quote_name(SEARCH_ENTRY_FTS_TABLE),
+            ),
+            "{fts_table} MATCH %s".format(
+                fts_table = connection.ops.quote_name(SEARCH_ENTRY_FTS_TABLE),
+            ),
+        )
+    
+    def do_search(self, engine_slug, queryset, search_text):
+        """Performs the full text search."""
+        return queryset.extra(
+            tables = (SEARCH_ENTRY_FTS_TABLE,),
+            where = self._get_match_sql(),
+            params = (escape_sqlite_fts5_query(search_text),),
+        )
+    
+    def do_search_ranking(self, engine_slug, queryset, search_text):
+        """Performs full text ranking."""
+        return queryset.extra(
+            select = {
+                "watson_rank": self.get_search_rank_sql(),
+            },
+            order_by = ("-watson_rank", "id",),
+        )
+    
+    def get_search_candidate_order_sql(self, search_text):
+        """Orders the candidates for full ranking by whether their titles match."""
+        return "watson_searchentry.id IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH %s) DESC, watson_searchentry.id".format(
+            fts_table = connection.ops.quote_name(SEARCH_ENTRY_FTS_TABLE),
+        ), ("{{title}} : ({query})".format(query = escape_sqlite_fts5_query(search_text)),)
+    
+    def do_search_seek(self, engine_slug, queryset, search_text, rank, pk):
+        """Performs a keyset seek past the given rank and search entry id."""
+        return queryset.extra(
+            where = ("({rank} < %s OR ({rank} = %s AND watson_searchentry.id > %s))".format(
+                rank = self.get_search_rank_sql(),
+            ),),
+            params = (rank, rank, pk),
+        )
+    
+    def do_filter(self, engine_slug, queryset, search_text):
+        """Performs the full text filter."""
+        model = queryset.model
+        content_type = ContentType.objects.get_for_model(model)
+        pk = model._meta.pk
+        if has_int_pk(model):
+            ref_name = "object_id_int"
+        else:
+            ref_name = "object_id"
+        return queryset.extra(
+            tables = ("watson_searchentry", SEARCH_ENTRY_FTS_TABLE,),
+            where = (
+                "watson_searchentry.engine_slug = %s",
+                "watson_searchentry.{ref_name} = {table_name}.{pk_name}".format(
+                    ref_name = ref_name,
+                    table_name = connection.ops.quote_name(model._meta.db_table),
+                    pk_name = connection.ops.quote_name(pk.db_column or pk.attname),
+                ),
+                "watson_searchentry.content_type_id = %s",
+            ) + self._get_match_sql(),
+            params = (engine_slug, content_type.id, escape_sqlite_fts5_query(search_text)),
+        )
+    
+    def do_filter_ranking(self, engine_slug, queryset, search_text):
+        """Performs the full text ranking."""
+        return queryset.extra(
+            select = {
+                "watson_rank": self.get_search_rank_sql(),
+            },
+            order_by = ("-watson_rank",),
+        )
+
+
+def has_sqlite_fts5(connection):
+    """Checks whether the SQLite connection supports FTS5 full text indexes."""
+    cursor = connection.cursor()
+    cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+    return bool(cursor.fetchone()[0])
+
+
+def install_sqlite_fts5():
+    """
+    Installs the SQLite FTS5 index, which the adaptive search backend uses once installed.
+
+    Databases that do not support FTS5 are left untouched.
+    """
+    if connection.vendor != "sqlite" or not has_sqlite_fts5(connection):
+        return
+    backend = Sqlite3FTS5SearchBackend()
+    if not backend.is_installed():
+        backend.do_install()
+
+
+def uninstall_sqlite_fts5():
+    """Drops the SQLite FTS5 index."""
+    if connection.vendor != "sqlite":
+        return
+    backend = Sqlite3FTS5SearchBackend()
+    if backend.is_installed():
+        backend.do_uninstall()
+
+
 def get_postgresql_version(connection):
     """Returns the version number of the PostgreSQL connection."""
     try:
@@ -472,4 +1511,9 @@ class AdaptiveSearchBackend(SearchBackend):
                 return PostgresLegacySearchBackend()
         if connection.vendor == "mysql":
             return MySQLSearchBackend()
+        if connection.vendor == "sqlite" and has_sqlite_fts5(connection):
+            backend = Sqlite3FTS5SearchBackend()
+            # Existing databases may not have the FTS5 index yet.
+            if backend.is_installed():
+                return backend
         return RegexSearchBackend()
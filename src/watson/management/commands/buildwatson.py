@@ -2,16 +2,31 @@
 
 from __future__ import unicode_literals, print_function
 
+import cProfile
+from datetime import datetime, time
+from functools import wraps
+from itertools import chain, islice
+from multiprocessing import Pool
 from optparse import make_option
+from timeit import default_timer as timer
+try:
+    import resource
+except ImportError:  # Windows.
+    resource = None
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import get_model
+from django.db.models import get_model, Min, Max
 from django.contrib import admin
 from django.contrib.contenttypes.models import ContentType
-from django.db import transaction
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.encoding import force_text
 
-from watson.registration import SearchEngine, _bulk_save_search_entries
-from watson.models import SearchEntry
+from watson.backends import SEARCH_ENTRY_SHADOW_TABLE, bulk_load_search_entries, create_shadow_table, delete_search_entries, lock_search_entry_table, supports_window_functions, swap_shadow_table
+from watson.registration import SearchEngine, get_backend, invalidate_search_cache, _bulk_save_search_entries, _end_dirty_search_engines, _iter_chunks
+from watson.models import SearchEntry, SearchIndexBuild, has_int_pk
 
 
 # Sets up registration for django-watson's admin integration.
@@ -24,16 +39,68 @@ def get_engine(engine_slug_):
     except IndexError:
         raise CommandError("Search Engine \"%s\" is not registered!" % engine_slug_)
 
-def rebuild_index_for_model(model_, engine_slug_, verbosity_):
-    '''rebuilds index for a model'''
+# The number of primary key ranges each worker process is given, to even out slow ranges.
+RANGES_PER_WORKER = 4
+
+# The number of objects loaded at a time, along with their related objects.
+LOAD_CHUNK_SIZE = 1000
+
+# The size of the search entry id ranges checked for orphans at a time.
+PRUNE_BATCH_SIZE = 10000
+
+# The number of primary keys looked up at a time, for models whose primary keys cannot be
+# compared to search entries in the database.
+PRUNE_LOOKUP_SIZE = 500
+
+def get_pk_boundaries(model_, range_size_):
+    '''
+    returns every range_size_-th primary key of a model, skipping the first, in a single
+    query using a window function
+    '''
+    pk_column = connection.ops.quote_name(model_._meta.pk.column)
+    cursor = connection.cursor()
+    cursor.execute("SELECT watson_pk FROM (SELECT {pk_column} AS watson_pk, ROW_NUMBER() OVER (ORDER BY {pk_column}) AS watson_row_number FROM {db_table}) watson_pks WHERE watson_row_number > 1 AND (watson_row_number - 1) %% %s = 0 ORDER BY watson_pk".format(
+        pk_column = pk_column,
+        db_table = connection.ops.quote_name(model_._meta.db_table),
+    ), (range_size_,))
+    return [pk for pk, in cursor.fetchall()]
+
+def get_pk_ranges(model_, range_count_):
+    '''
+    splits the primary keys of a model into roughly equal (lower, upper) ranges. without
+    window functions, integer primary keys are split into equal strides between the lowest
+    and highest primary key, so gaps in the primary keys can make the ranges uneven
+    '''
+    pks = model_._base_manager.order_by("pk").values_list("pk", flat=True)
+    if supports_window_functions():
+        object_count = pks.count()
+        boundaries = get_pk_boundaries(model_, max(object_count // range_count_, 1))
+    elif has_int_pk(model_):
+        pk_range = model_._base_manager.aggregate(min_pk=Min("pk"), max_pk=Max("pk"))
+        if pk_range["min_pk"] is None:
+            boundaries = []
+        else:
+            stride = max((pk_range["max_pk"] - pk_range["min_pk"] + 1) // range_count_, 1)
+            boundaries = list(range(pk_range["min_pk"] + stride, pk_range["max_pk"] + 1, stride))
+    else:
+        object_count = pks.count()
+        range_size = max(object_count // range_count_, 1)
+        boundaries = [pks[offset] for offset in range(range_size, object_count, range_size)]
+    return list(zip([None] + boundaries, boundaries + [None]))
+
+def rebuild_index_for_objects(objs_, model_, engine_slug_, verbosity_, bulk_load_=False, db_table_=None, stats_=None):
+    '''
+    rebuilds index for the given objects of a model, bulk loading plain rows into db_table_
+    (by default the search entry table) if bulk_load_ is set, in which case the model's
+    search entries must already have been cleared, and timing database writes if given stats
+    '''
 
     search_engine_ = get_engine(engine_slug_)
 
     local_refreshed_model_count = [0]  # HACK: Allows assignment to outer scope.
-    def iter_search_entries():
-        for obj in model_._default_manager.all().iterator():
-            for search_entry in search_engine_._update_obj_index_iter(obj):
-                yield search_entry
+    def iter_objs():
+        for obj in objs_:
+            yield obj
             local_refreshed_model_count[0] += 1
             if verbosity_ >= 3:
                 print("Refreshed search entry for {model} {obj} in {engine_slug!r} search engine.".format(
@@ -41,28 +108,482 @@ def rebuild_index_for_model(model_, engine_slug_, verbosity_):
                     obj = obj,
                     engine_slug = engine_slug_,
                 ))
-        if verbosity_ == 2:
-            print("Refreshed {local_refreshed_model_count} {model} search entry(s) in {engine_slug!r} search engine.".format(
-                model = model_._meta.verbose_name,
-                local_refreshed_model_count = local_refreshed_model_count[0],
-                engine_slug = engine_slug_,
-            ))
-    _bulk_save_search_entries(iter_search_entries())
+    if stats_ is not None:
+        # Render each batch of search entries up front, so that the writes can be timed on their own.
+        objs = iter_objs()
+        while True:
+            obj_batch = list(islice(objs, LOAD_CHUNK_SIZE))
+            if not obj_batch:
+                break
+            if bulk_load_:
+                stats_.time_write(bulk_load_search_entries, list(search_engine_._iter_objs_search_entry_rows(obj_batch)), db_table_, backend=get_backend())
+            else:
+                stats_.time_write(_bulk_save_search_entries, list(search_engine_._update_objs_index_iter(obj_batch)))
+    elif bulk_load_:
+        bulk_load_search_entries(search_engine_._iter_objs_search_entry_rows(iter_objs()), db_table_, backend=get_backend())
+    else:
+        _bulk_save_search_entries(search_engine_._update_objs_index_iter(iter_objs()))
     return local_refreshed_model_count[0]
 
+def parse_since(since_):
+    '''parses the --since option into "last" or a timestamp'''
+    if since_ == "last":
+        return since_
+    try:
+        since = parse_datetime(since_)
+        if since is None:
+            since_date = parse_date(since_)
+            if since_date is not None:
+                since = datetime.combine(since_date, time())
+    except ValueError:
+        since = None
+    if since is None:
+        raise CommandError("\"%s\" is not a valid timestamp, or \"last\"!" % since_)
+    if settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.get_default_timezone())
+    return since
+
+def get_since(model_, engine_slug_, since_):
+    '''returns the timestamp to incrementally rebuild a model from, or None for a full rebuild'''
+    if since_ is None or not get_engine(engine_slug_).get_adapter(model_).modified_field:
+        return None
+    if since_ == "last":
+        built_ats = SearchIndexBuild.objects.filter(
+            engine_slug = engine_slug_,
+            content_type = ContentType.objects.get_for_model(model_),
+        ).values_list("built_at", flat=True)
+        if built_ats:
+            return built_ats[0]
+        return None
+    return since_
+
+def record_index_build(model_, engine_slug_, built_at_):
+    '''records the start time of the last successful rebuild of a model's index'''
+    content_type = ContentType.objects.get_for_model(model_)
+    update_count = SearchIndexBuild.objects.filter(
+        engine_slug = engine_slug_,
+        content_type = content_type,
+    ).update(
+        built_at = built_at_,
+    )
+    if update_count == 0:
+        SearchIndexBuild.objects.create(
+            engine_slug = engine_slug_,
+            content_type = content_type,
+            built_at = built_at_,
+        )
+
+def rebuild_index_for_pk_range(model_, engine_slug_, verbosity_, pk_range_=(None, None), chunk_size_=None, since_=None, stats_=None, bulk_load_=False, db_table_=None):
+    '''
+    rebuilds index for the objects of a model within a primary key range, committing
+    every chunk_size_ objects if given a chunk size, only including objects modified
+    since since_ if given a timestamp, timing database reads if given stats, and bulk
+    loading plain rows into db_table_ if bulk_load_ is set
+    '''
+    queryset = get_engine(engine_slug_).get_adapter(model_).get_index_queryset(model_._base_manager.all())
+    if since_ is not None:
+        queryset = queryset.filter(**{
+            "{modified_field}__gte".format(
+                modified_field = get_engine(engine_slug_).get_adapter(model_).modified_field,
+            ): since_,
+        })
+    lower_pk, upper_pk = pk_range_
+    if lower_pk is not None:
+        queryset = queryset.filter(pk__gte=lower_pk)
+    if upper_pk is not None:
+        queryset = queryset.filter(pk__lt=upper_pk)
+    chunks = _iter_chunks(queryset, chunk_size_ or LOAD_CHUNK_SIZE)
+    if stats_ is not None:
+        chunks = stats_.time_iter(chunks)
+    if chunk_size_ is None:
+        return rebuild_index_for_objects(chain.from_iterable(chunks), model_, engine_slug_, verbosity_, bulk_load_, db_table_, stats_)
+    local_refreshed_model_count = 0
+    for chunk in chunks:
+        with transaction.atomic():
+            local_refreshed_model_count += rebuild_index_for_objects(chunk, model_, engine_slug_, verbosity_, stats_=stats_)
+        # invalidate the cached search results again, now that the chunk has been committed
+        _end_dirty_search_engines()
+    return local_refreshed_model_count
+
+def rebuild_index_for_pk_range_worker(args_):
+    '''rebuilds index for a primary key range inside a worker process, using its own database connection'''
+    app_label, model_name, engine_slug_, verbosity_, pk_range_, chunk_size_, since_ = args_
+    model_ = get_model(app_label, model_name)
+    if chunk_size_ is not None:
+        return rebuild_index_for_pk_range(model_, engine_slug_, verbosity_, pk_range_, chunk_size_, since_)
+    try:
+        with transaction.atomic():
+            return rebuild_index_for_pk_range(model_, engine_slug_, verbosity_, pk_range_, since_=since_)
+    finally:
+        # invalidate the cached search results again, now that the range has been committed
+        _end_dirty_search_engines()
+
+def rebuild_index_for_model(model_, engine_slug_, verbosity_, pool_=None, workers_=1, chunk_size_=None, since_=None, stats_=None, bulk_load_=False, db_table_=None):
+    '''
+    rebuilds index for a model, splitting it into primary key ranges if given a worker pool,
+    only including objects modified since since_ (a timestamp or "last") if the model's
+    search adapter declares a modified field, collecting timings if given stats, and
+    replacing the model's search entries with bulk loaded rows if bulk_load_ is set, or
+    bulk loading them into the empty db_table_ if also given a table
+    '''
+
+    built_at = timezone.now()
+    since = get_since(model_, engine_slug_, since_)
+    if bulk_load_ and db_table_ is None:
+        SearchEntry.objects.filter(
+            engine_slug = engine_slug_,
+            content_type = ContentType.objects.get_for_model(model_),
+        ).delete()
+    if stats_ is not None:
+        stats_.start(get_engine(engine_slug_).get_adapter(model_))
+        try:
+            local_refreshed_model_count = rebuild_index_for_pk_range(model_, engine_slug_, verbosity_, chunk_size_=chunk_size_, since_=since, stats_=stats_, bulk_load_=bulk_load_, db_table_=db_table_)
+        finally:
+            stats_.stop()
+        stats_.object_count += local_refreshed_model_count
+    elif pool_ is None:
+        local_refreshed_model_count = rebuild_index_for_pk_range(model_, engine_slug_, verbosity_, chunk_size_=chunk_size_, since_=since, bulk_load_=bulk_load_, db_table_=db_table_)
+    else:
+        local_refreshed_model_count = sum(pool_.map(rebuild_index_for_pk_range_worker, [
+            (model_._meta.app_label, model_._meta.object_name, engine_slug_, verbosity_, pk_range, chunk_size_, since)
+            for pk_range in get_pk_ranges(model_, workers_ * RANGES_PER_WORKER)
+        ]))
+    record_index_build(model_, engine_slug_, built_at)
+    if verbosity_ == 2:
+        print("Refreshed {local_refreshed_model_count} {model} search entry(s) in {engine_slug!r} search engine.".format(
+            model = model_._meta.verbose_name,
+            local_refreshed_model_count = local_refreshed_model_count,
+            engine_slug = engine_slug_,
+        ))
+    return local_refreshed_model_count
+
+def prune_shadow_orphans(model_, engine_slug_):
+    '''
+    deletes the shadow search entries of a model whose objects no longer exist, returning
+    the number deleted
+    '''
+    content_type = ContentType.objects.get_for_model(model_)
+    cursor = connection.cursor()
+    orphan_filter = get_orphan_filter(model_, SEARCH_ENTRY_SHADOW_TABLE)
+    if orphan_filter is not None:
+        cursor.execute("DELETE FROM {shadow_table} WHERE engine_slug = %s AND content_type_id = %s AND {orphan_filter}".format(
+            shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE),
+            orphan_filter = orphan_filter,
+        ), (engine_slug_, content_type.id))
+        return cursor.rowcount
+    cursor.execute("SELECT object_id FROM {shadow_table} WHERE engine_slug = %s AND content_type_id = %s".format(
+        shadow_table = connection.ops.quote_name(SEARCH_ENTRY_SHADOW_TABLE),
+    ), (engine_slug_, content_type.id))
+    object_ids = [object_id for object_id, in cursor.fetchall()]
+    return delete_search_entries(engine_slug_, content_type.id, get_missing_object_ids(object_ids, model_), SEARCH_ENTRY_SHADOW_TABLE)
+
+def replay_shadow_changes(engine_slugs_, since_, verbosity_):
+    '''
+    reloads the shadow search entries of objects modified since since_, and deletes those
+    of objects that no longer exist, so that changes written to the search entry table
+    while the shadow table was loading survive the swap. only models whose search adapters
+    declare a modified field can have their modified objects replayed
+    '''
+    lock_search_entry_table()
+    replayed_model_count = 0
+    pruned_count = 0
+    for engine_slug_ in engine_slugs_:
+        search_engine_ = get_engine(engine_slug_)
+        for model_ in search_engine_.get_registered_models():
+            pruned_count += prune_shadow_orphans(model_, engine_slug_)
+            modified_field = search_engine_.get_adapter(model_).modified_field
+            if not modified_field:
+                continue
+            content_type = ContentType.objects.get_for_model(model_)
+            modified_pks = model_._base_manager.filter(**{
+                "{modified_field}__gte".format(
+                    modified_field = modified_field,
+                ): since_,
+            }).values_list("pk", flat=True).iterator()
+            while True:
+                pk_batch = list(islice(modified_pks, LOAD_CHUNK_SIZE))
+                if not pk_batch:
+                    break
+                delete_search_entries(engine_slug_, content_type.id, pk_batch, SEARCH_ENTRY_SHADOW_TABLE)
+            replayed_model_count += rebuild_index_for_pk_range(model_, engine_slug_, verbosity_, since_=since_, bulk_load_=True, db_table_=SEARCH_ENTRY_SHADOW_TABLE)
+    if verbosity_ >= 2:
+        print("Replayed {replayed_model_count} search entry(s) modified during the shadow rebuild.".format(
+            replayed_model_count = replayed_model_count,
+        ))
+        print("Pruned {pruned_count} search entry(s) deleted during the shadow rebuild.".format(
+            pruned_count = pruned_count,
+        ))
+    return replayed_model_count
+
+class RebuildStats(object):
+
+    """Throughput and timing statistics for rebuilding the index of a single model."""
+    
+    ADAPTER_METHODS = ("get_title", "get_description", "get_content", "get_url", "get_meta",)
+    
+    def __init__(self, model, engine_slug, profile=False):
+        """Initializes the statistics."""
+        self.model = model
+        self.engine_slug = engine_slug
+        self.object_count = 0
+        self.total_time = 0.0
+        self.read_time = 0.0
+        self.write_time = 0.0
+        self.adapter_times = dict((method_name, 0.0) for method_name in self.ADAPTER_METHODS)
+        self.peak_memory = None
+        self.profiler = cProfile.Profile() if profile else None
+    
+    def start(self, adapter):
+        """Starts timing a rebuild using the given search adapter."""
+        self._adapter = adapter
+        self._start_time = timer()
+        # Time each adapter method, by shadowing it with a timed wrapper on the adapter instance.
+        for method_name in self.ADAPTER_METHODS:
+            setattr(adapter, method_name, self._time_adapter_method(method_name, getattr(adapter, method_name)))
+        if self.profiler is not None:
+            self.profiler.enable()
+    
+    def stop(self):
+        """Stops timing the rebuild."""
+        if self.profiler is not None:
+            self.profiler.disable()
+        for method_name in self.ADAPTER_METHODS:
+            delattr(self._adapter, method_name)
+        self.total_time += timer() - self._start_time
+        # This is the peak of the whole process so far, rather than of this model.
+        if resource is not None:
+            self.peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    def _time_adapter_method(self, method_name, method):
+        """Wraps the given adapter method, adding its running time to the statistics."""
+        @wraps(method)
+        def do_time_adapter_method(obj):
+            start_time = timer()
+            try:
+                return method(obj)
+            finally:
+                self.adapter_times[method_name] += timer() - start_time
+        return do_time_adapter_method
+    
+    def time_iter(self, objs):
+        """Yields from the given iterable, adding the time taken to read each item to the statistics."""
+        objs = iter(objs)
+        while True:
+            start_time = timer()
+            try:
+                obj = next(objs)
+            except StopIteration:
+                return
+            finally:
+                self.read_time += timer() - start_time
+            yield obj
+    
+    def time_write(self, write, *args, **kwargs):
+        """Calls the given function to write search entries, adding its running time to the statistics."""
+        start_time = timer()
+        try:
+            return write(*args, **kwargs)
+        finally:
+            self.write_time += timer() - start_time
+    
+    def format(self):
+        """Formats the statistics as a single report line."""
+        return "{app_label}.{model_name} in {engine_slug!r} search engine: {object_count} object(s) in {total_time:.3f}s ({rate:.1f}/s); read {read_time:.3f}s, {adapter_times}, write {write_time:.3f}s, process peak memory {peak_memory}".format(
+            app_label = self.model._meta.app_label,
+            model_name = self.model._meta.object_name,
+            engine_slug = self.engine_slug,
+            object_count = self.object_count,
+            total_time = self.total_time,
+            rate = self.object_count / self.total_time if self.total_time else 0.0,
+            read_time = self.read_time,
+            adapter_times = ", ".join(
+                "{method_name} {method_time:.3f}s".format(
+                    method_name = method_name,
+                    method_time = self.adapter_times[method_name],
+                )
+                for method_name in self.ADAPTER_METHODS
+            ),
+            write_time = self.write_time,
+            peak_memory = "unknown" if self.peak_memory is None else "{peak_memory} (ru_maxrss)".format(
+                peak_memory = self.peak_memory,
+            ),
+        )
+
+def get_orphan_filter(model_, db_table_):
+    '''
+    returns a sql filter matching the search entries in db_table_ whose objects no longer
+    exist, or None if the model's primary keys cannot be compared to them in the database
+    '''
+    if has_int_pk(model_) or model_._meta.pk.get_internal_type() in ("CharField", "TextField", "SlugField"):
+        # Probe the model's primary key for each search entry, rather than scanning the whole
+        # model table for every batch.
+        return "NOT EXISTS (SELECT 1 FROM {model_table} WHERE {model_table}.{pk_column} = {db_table}.{object_id_column})".format(
+            model_table = connection.ops.quote_name(model_._meta.db_table),
+            pk_column = connection.ops.quote_name(model_._meta.pk.column),
+            db_table = connection.ops.quote_name(db_table_),
+            object_id_column = "object_id_int" if has_int_pk(model_) else "object_id",
+        )
+    return None
+
+def get_missing_object_ids(object_ids_, model_):
+    '''returns the given object ids whose objects no longer exist, looking them up in batches'''
+    missing_object_ids = set(object_ids_)
+    object_id_list = list(missing_object_ids)
+    for index in range(0, len(object_id_list), PRUNE_LOOKUP_SIZE):
+        for pk in model_._base_manager.filter(pk__in=object_id_list[index:index + PRUNE_LOOKUP_SIZE]).values_list("pk", flat=True):
+            missing_object_ids.discard(force_text(pk))
+    return missing_object_ids
+
+def prune_orphans(search_entries_, model_):
+    '''deletes the given search entries whose objects no longer exist, returning the number deleted'''
+    orphan_filter = get_orphan_filter(model_, SearchEntry._meta.db_table)
+    if orphan_filter is not None:
+        orphans = search_entries_.extra(where=(orphan_filter,))
+    else:
+        # Primary keys of other types cannot be compared to the object_id column in the
+        # database, so look them up in batches instead.
+        entry_ids = dict(search_entries_.values_list("object_id", "id"))
+        orphans = search_entries_.filter(id__in=[
+            entry_ids[object_id]
+            for object_id in get_missing_object_ids(entry_ids, model_)
+        ])
+    orphan_count = orphans.count()
+    if orphan_count > 0:
+        orphans.delete()
+    return orphan_count
+
+def prune_index_for_model(model_, engine_slug_, verbosity_, chunk_size_=None):
+    '''
+    deletes search entries for objects of a model that no longer exist, using a set-based
+    anti-join against the model's table for each range of search entry ids, committing
+    each range separately if given a chunk size
+    '''
+    search_entries = SearchEntry.objects.filter(
+        engine_slug = engine_slug_,
+        content_type = ContentType.objects.get_for_model(model_),
+    )
+    id_range = search_entries.aggregate(min_id=Min("id"), max_id=Max("id"))
+    batch_size = chunk_size_ or PRUNE_BATCH_SIZE
+    local_pruned_count = 0
+    if id_range["min_id"] is not None:
+        for start_id in range(id_range["min_id"], id_range["max_id"] + 1, batch_size):
+            batch = search_entries.filter(id__gte=start_id, id__lt=start_id + batch_size)
+            if chunk_size_ is None:
+                local_pruned_count += prune_orphans(batch, model_)
+            else:
+                with transaction.atomic():
+                    local_pruned_count += prune_orphans(batch, model_)
+    if verbosity_ >= 2:
+        print("Pruned {local_pruned_count} orphaned {model} search entry(s) in {engine_slug!r} search engine.".format(
+            model = model_._meta.verbose_name,
+            local_pruned_count = local_pruned_count,
+            engine_slug = engine_slug_,
+        ))
+    return local_pruned_count
+
+def prune_stale_content_types(engine_slug_, registered_models_, verbosity_):
+    '''deletes search entries for content types that are no longer registered with a search engine'''
+    valid_content_types = [ContentType.objects.get_for_model(model) for model in registered_models_]
+    stale_entries = SearchEntry.objects.filter(
+        engine_slug = engine_slug_,
+    ).exclude(
+        content_type__in = valid_content_types
+    )
+    stale_entry_count = stale_entries.count()
+    if stale_entry_count > 0:
+        stale_entries.delete()
+    if verbosity_ >= 1:
+        print("Deleted {stale_entry_count} stale search entry(s) in {engine_slug!r} search engine.".format(
+            stale_entry_count = stale_entry_count,
+            engine_slug = engine_slug_,
+        ))
+    return stale_entry_count
+
 class Command(BaseCommand):
-    args = "[[--engine=search_engine] <app.model|model> <app.model|model> ... ]"
+    args = "[[--engine=search_engine] [--workers=N] [--chunk-size=N] [--since=timestamp|last] [--prune] [--stats] [--profile=file] [--bulk-load] [--shadow] [--refresh-live] <app.model|model> <app.model|model> ... ]"
     help = "Rebuilds the database indices needed by django-watson. You can (re-)build index for selected models by specifying them"
 
     option_list = BaseCommand.option_list + (
         make_option("--engine",
             help="Search engine models are registered with"),
+        make_option("--workers",
+            type="int",
+            default=1,
+            help="Number of worker processes to rebuild each model's primary key ranges in parallel"),
+        make_option("--chunk-size",
+            type="int",
+            dest="chunk_size",
+            help="Commit the rebuilt index every N objects, instead of in a single transaction"),
+        make_option("--since",
+            help="Only rebuild objects modified since the given timestamp, or since the last successful rebuild if \"last\". Requires a modified_field on the search adapter"),
+        make_option("--prune",
+            action="store_true",
+            default=False,
+            help="Delete search entries for objects that no longer exist, instead of rebuilding the index"),
+        make_option("--stats",
+            action="store_true",
+            default=False,
+            help="Report throughput and database and adapter timings for each model, along with the peak memory of the process"),
+        make_option("--profile",
+            help="Implies --stats, and dumps profiler stats for the slowest model to the given file"),
+        make_option("--bulk-load",
+            action="store_true",
+            dest="bulk_load",
+            default=False,
+            help="Replace each model's search entries in a single transaction by streaming fresh rows with COPY or executemany, instead of updating them in place. On PostgreSQL, rebuilding every model drops the full text index and builds it again once loaded, so searches wait until the rebuild commits, while rebuilding some models still updates the full text index row by row"),
+        make_option("--shadow",
+            action="store_true",
+            default=False,
+            help="Bulk load every search engine into a copy of the search entry table, then swap it in, so searches use the old index until the rebuild is complete. Objects deleted during the rebuild are pruned before the swap, and objects modified during it are reloaded if their search adapter declares a modified_field, but other models need another rebuild to pick up changes made while it ran. On MySQL, creating and swapping the table commit the transaction, so the rebuild is not a single transaction and writes are not blocked during the swap"),
+        make_option("--refresh-live",
+            action="store_true",
+            dest="refresh_live",
+            default=False,
+            help="Update the live flags stored on search entries for models whose search adapters use store_is_live, instead of rebuilding the index"),
         )
 
-    @transaction.atomic()
     def handle(self, *args, **options):
         """Runs the management command."""
+        workers = options.get("workers") or 1
+        chunk_size = options.get("chunk_size")
+        if chunk_size is not None and chunk_size < 1:
+            raise CommandError("--chunk-size must be a positive number!")
+        if options.get("shadow") and (args or options.get("engine") or options.get("prune") or options.get("since") is not None or workers > 1 or chunk_size is not None):
+            raise CommandError("--shadow rebuilds every model in every search engine at once, so cannot be used with models, --engine, --prune, --since, --workers or --chunk-size!")
+        if options.get("bulk_load") and (workers > 1 or chunk_size is not None or options.get("since") is not None):
+            raise CommandError("--bulk-load replaces the index in a single transaction, so cannot be used with --workers, --chunk-size or --since!")
+        if options.get("refresh_live") and (options.get("prune") or options.get("shadow") or options.get("bulk_load") or options.get("since") is not None or workers > 1 or chunk_size is not None):
+            raise CommandError("--refresh-live updates the live flags in a single transaction, so cannot be used with --prune, --shadow, --bulk-load, --since, --workers or --chunk-size!")
+        if workers > 1 and (options.get("stats") or options.get("profile")):
+            raise CommandError("--stats and --profile cannot be used with --workers!")
+        if workers > 1 and connection.vendor == "sqlite":
+            raise CommandError("SQLite does not support concurrent writes, so cannot be used with --workers!")
+        if workers > 1:
+            # Each worker writes its own ranges in its own transaction, using its own database
+            # connection, so close ours before forking.
+            connection.close()
+            pool = Pool(workers)
+            try:
+                self.rebuild(args, options, pool, workers)
+            finally:
+                pool.terminate()
+                pool.join()
+        elif chunk_size is not None:
+            # Each chunk is committed in its own transaction.
+            self.rebuild(args, options)
+        else:
+            with transaction.atomic():
+                self.rebuild(args, options)
+        # Invalidate the cached search results, now that the rebuild has been committed.
+        invalidate_search_cache(x[0] for x in SearchEngine.get_created_engines())
+
+    def rebuild(self, args, options, pool=None, workers=1):
+        """Rebuilds the search indices for the requested models and search engines."""
         verbosity = int(options.get("verbosity", 1))
+        chunk_size = options.get("chunk_size")
+        since = options.get("since")
+        if since is not None:
+            since = parse_since(since)
 
         # see if we're asked to use a specific search engine
         if options['engine']:
@@ -94,11 +615,78 @@ class Command(BaseCommand):
         
         refreshed_model_count = 0
 
+        # collect statistics for each model if requested
+        profile = options.get("profile")
+        all_stats = []
+        def get_stats(model_, engine_slug_):
+            if not (options.get("stats") or profile):
+                return None
+            stats = RebuildStats(model_, engine_slug_, profile=bool(profile))
+            all_stats.append(stats)
+            return stats
+
+        if options.get("prune"):
+            if models:
+                engine_models = [(engine_slug, models)]
+            elif engine_selected:
+                engine_models = [(engine_slug, None)]
+            else:
+                engine_models = [(x[0], None) for x in SearchEngine.get_created_engines()]
+            for engine_slug, prune_models in engine_models:
+                search_engine = get_engine(engine_slug)
+                pruned_count = 0
+                if prune_models is None:
+                    prune_models = search_engine.get_registered_models()
+                    pruned_count += prune_stale_content_types(engine_slug, prune_models, verbosity)
+                for model in prune_models:
+                    pruned_count += prune_index_for_model(model, engine_slug, verbosity, chunk_size)
+                if verbosity >= 1:
+                    print("Pruned {pruned_count} search entry(s) in {engine_slug!r} search engine.".format(
+                        pruned_count = pruned_count,
+                        engine_slug = engine_slug,
+                    ))
+            return
+
+        if options.get("refresh_live"):
+            if models:
+                engine_models = [(engine_slug, models)]
+            elif engine_selected:
+                engine_models = [(engine_slug, None)]
+            else:
+                engine_models = [(x[0], None) for x in SearchEngine.get_created_engines()]
+            for engine_slug, live_models in engine_models:
+                search_engine = get_engine(engine_slug)
+                if live_models is None:
+                    live_models = [model for model in search_engine.get_registered_models() if search_engine.get_adapter(model).store_is_live]
+                refreshed_count = 0
+                for model in live_models:
+                    local_refreshed_count = search_engine.update_live_index(model)
+                    if verbosity >= 2:
+                        print("Refreshed {local_refreshed_count} {model} live flag(s) in {engine_slug!r} search engine.".format(
+                            model = model._meta.verbose_name,
+                            local_refreshed_count = local_refreshed_count,
+                            engine_slug = engine_slug,
+                        ))
+                    refreshed_count += local_refreshed_count
+                if verbosity >= 1:
+                    print("Refreshed {refreshed_count} live flag(s) in {engine_slug!r} search engine.".format(
+                        refreshed_count = refreshed_count,
+                        engine_slug = engine_slug,
+                    ))
+            return
+
+        # bulk load the search entry table in place, unless loading a copy of it below, dropping
+        # indexes that are cheaper to rebuild afterwards if the whole table is being reloaded
+        bulk_load = options.get("bulk_load") and not options.get("shadow")
+        drop_indexes = not models
+        if bulk_load:
+            get_backend().begin_bulk_load(SearchEntry._meta.db_table, drop_indexes)
+
         if models:  # request for (re-)building index for a subset of registered models
             if verbosity >= 3:
                 print("Using search engine \"%s\"" % engine_slug)
             for model in models:
-                refreshed_model_count += rebuild_index_for_model(model, engine_slug, verbosity)
+                refreshed_model_count += rebuild_index_for_model(model, engine_slug, verbosity, pool, workers, chunk_size, since, get_stats(model, engine_slug), options.get("bulk_load"))
 
         else:  # full rebuild (for one or all search engines)
             if engine_selected:
@@ -109,31 +697,50 @@ class Command(BaseCommand):
             else:  # loop through all engines
                 engine_slugs = [x[0] for x in SearchEngine.get_created_engines()]
 
+            # load a copy of the search entry table if requested, which only ever contains registered models
+            shadow = options.get("shadow")
+            if shadow:
+                shadow_started_at = timezone.now()
+                create_shadow_table()
+                backend = get_backend()
+                backend.begin_bulk_load(SEARCH_ENTRY_SHADOW_TABLE)
+
             for engine_slug in engine_slugs:
                 search_engine = get_engine(engine_slug)
                 registered_models = search_engine.get_registered_models()
                 # Rebuild the index for all registered models.
                 for model in registered_models:
-                    refreshed_model_count += rebuild_index_for_model(model, engine_slug, verbosity)
+                    if shadow:
+                        refreshed_model_count += rebuild_index_for_model(model, engine_slug, verbosity, stats_=get_stats(model, engine_slug), bulk_load_=True, db_table_=SEARCH_ENTRY_SHADOW_TABLE)
+                    else:
+                        refreshed_model_count += rebuild_index_for_model(model, engine_slug, verbosity, pool, workers, chunk_size, since, get_stats(model, engine_slug), options.get("bulk_load"))
+                # Clean out any search entries that exist for stale content types. Only do it during full rebuild
+                if since is None and not shadow:
+                    prune_stale_content_types(engine_slug, registered_models, verbosity)
 
-            # Clean out any search entries that exist for stale content types. Only do it during full rebuild
-            valid_content_types = [ContentType.objects.get_for_model(model) for model in registered_models]
-            stale_entries = SearchEntry.objects.filter(
-                engine_slug = engine_slug,
-            ).exclude(
-                content_type__in = valid_content_types
-            )
-            stale_entry_count = stale_entries.count()
-            if stale_entry_count > 0:
-                stale_entries.delete()
-            if verbosity >= 1:
-                print("Deleted {stale_entry_count} stale search entry(s) in {engine_slug!r} search engine.".format(
-                    stale_entry_count = stale_entry_count,
-                    engine_slug = engine_slug,
-                ))
+            if shadow:
+                replay_shadow_changes(engine_slugs, shadow_started_at, verbosity)
+                backend.end_bulk_load(SEARCH_ENTRY_SHADOW_TABLE)
+                swap_shadow_table()
+
+        if bulk_load:
+            get_backend().end_bulk_load(SearchEntry._meta.db_table, drop_indexes)
 
         if verbosity == 1:
             print("Refreshed {refreshed_model_count} search entry(s) in {engine_slug!r} search engine.".format(
                 refreshed_model_count = refreshed_model_count,
                 engine_slug = engine_slug,
             ))
+
+        # report the statistics, dumping the profile of the slowest model
+        for stats in all_stats:
+            print(stats.format())
+        if profile and all_stats:
+            slowest_stats = max(all_stats, key=lambda stats: stats.total_time)
+            slowest_stats.profiler.dump_stats(profile)
+            print("Dumped profiler stats for {app_label}.{model_name} in {engine_slug!r} search engine to {profile}.".format(
+                app_label = slowest_stats.model._meta.app_label,
+                model_name = slowest_stats.model._meta.object_name,
+                engine_slug = slowest_stats.engine_slug,
+                profile = profile,
+            ))
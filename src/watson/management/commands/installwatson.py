@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 
 from django.core.management.base import NoArgsCommand
 
+from watson.backends import install_unique_index, install_queue_index, install_sqlite_fts5
 from watson.registration import get_backend
 
 
@@ -14,6 +15,9 @@ class Command(NoArgsCommand):
     def handle_noargs(self, **options):
         """Runs the management command."""
         verbosity = int(options.get("verbosity", 1))
+        install_unique_index()
+        install_queue_index()
+        install_sqlite_fts5()
         backend = get_backend()
         if not backend.requires_installation:
             if verbosity >= 2:
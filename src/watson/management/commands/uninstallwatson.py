@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 
 from django.core.management.base import NoArgsCommand
 
+from watson.backends import uninstall_sqlite_fts5
 from watson.registration import get_backend
 
 
@@ -25,3 +26,4 @@ class Command(NoArgsCommand):
         else:
             if verbosity >= 2:
                 self.stdout.write("django-watson is not installed.\n")
+        uninstall_sqlite_fts5()
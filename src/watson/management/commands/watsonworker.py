@@ -0,0 +1,172 @@
+"""Processes the search index updates queued by django-watson."""
+
+from __future__ import unicode_literals
+
+import time, logging
+from collections import defaultdict
+from itertools import chain
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, connection, transaction
+
+from watson.models import SearchQueueEntry
+from watson.registration import SearchEngine, _bulk_save_search_entries, _create_key_filter, _end_dirty_search_engines
+
+
+# Sets up registration for django-watson's admin integration.
+admin.autodiscover()
+
+
+logger = logging.getLogger(__name__)
+
+
+def supports_skip_locked():
+    """Checks whether the database can skip rows locked by other workers."""
+    if connection.vendor == "postgresql":
+        return connection.pg_version >= 90500
+    if connection.vendor == "mysql":
+        return connection.mysql_version >= (8, 0, 1)
+    return False
+
+
+def get_lock_sql():
+    """Returns the SQL used to lock selected queue entries against other workers."""
+    if supports_skip_locked():
+        return " FOR UPDATE SKIP LOCKED"
+    if connection.features.has_select_for_update:
+        return " FOR UPDATE"
+    return ""
+
+
+def lock_queue_entries(batch_size):
+    """
+    Returns the (engine_slug, content_type_id, object_id) keys of a batch of queued
+    objects, mapped to the ids of their queue entries, locking them against other
+    workers where the database supports it.
+    
+    Any other queue entries for the same objects are locked and returned too, unless
+    another worker has already locked them.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT id, engine_slug, content_type_id, object_id FROM {db_table} ORDER BY id LIMIT %s{lock_sql}".format(
+        db_table = connection.ops.quote_name(SearchQueueEntry._meta.db_table),
+        lock_sql = get_lock_sql(),
+    ), (batch_size,))
+    queue_entry_ids = defaultdict(set)
+    for queue_entry_id, engine_slug, content_type_id, object_id in cursor.fetchall():
+        queue_entry_ids[(engine_slug, content_type_id, object_id)].add(queue_entry_id)
+    if queue_entry_ids:
+        # Lock the other pending work for the same objects.
+        sql, params = SearchQueueEntry.objects.filter(
+            _create_key_filter(queue_entry_ids),
+        ).values_list("id", "engine_slug", "content_type_id", "object_id").query.sql_with_params()
+        cursor.execute(sql + get_lock_sql(), params)
+        for queue_entry_id, engine_slug, content_type_id, object_id in cursor.fetchall():
+            queue_entry_ids[(engine_slug, content_type_id, object_id)].add(queue_entry_id)
+    return queue_entry_ids
+
+
+def save_queued_search_entries(keys):
+    """
+    Updates the search entries for the given (engine_slug, content_type_id, object_id)
+    keys, reloading the objects in bulk.
+    
+    Objects that have since been deleted or unregistered are skipped.
+    """
+    search_engines = dict(SearchEngine.get_created_engines())
+    object_ids = defaultdict(list)
+    for engine_slug, content_type_id, object_id in keys:
+        object_ids[(engine_slug, content_type_id)].append(object_id)
+    search_entries = []
+    for (engine_slug, content_type_id), object_id_list in object_ids.items():
+        search_engine = search_engines.get(engine_slug)
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if search_engine is None or model is None or not search_engine.is_registered(model):
+            continue
+        search_entries.append(search_engine._update_objs_index_iter(
+            search_engine._load_objs_iter(model, object_id_list),
+        ))
+    _bulk_save_search_entries(chain.from_iterable(search_entries))
+
+
+def process_queue_batch(batch_size):
+    """
+    Updates the search entries for a batch of queued objects, returning the number of objects processed.
+    
+    If the batch fails, its objects are retried one at a time, and any object that still
+    fails is logged and removed from the queue, so that it cannot stall the queue.
+    """
+    try:
+        with transaction.atomic():
+            queue_entry_ids = lock_queue_entries(batch_size)
+            if not queue_entry_ids:
+                return 0
+            # Remove the locked queue entries only, so that other workers are never waited on.
+            SearchQueueEntry.objects.filter(
+                id__in = list(chain.from_iterable(queue_entry_ids.values())),
+            ).delete()
+            try:
+                with transaction.atomic():
+                    save_queued_search_entries(queue_entry_ids)
+            except Exception:
+                logger.warning("Could not update a batch of %d queued search entries, retrying them one at a time.", len(queue_entry_ids), exc_info=True)
+                for key in queue_entry_ids:
+                    try:
+                        with transaction.atomic():
+                            save_queued_search_entries((key,))
+                    except Exception:
+                        logger.exception("Could not update the queued search entry for object %r of content type %r in %r search engine, skipping it.", key[2], key[1], key[0])
+            return len(queue_entry_ids)
+    finally:
+        # Invalidate the cached search results again, now that the batch has been committed.
+        _end_dirty_search_engines()
+
+
+class Command(NoArgsCommand):
+
+    help = "Processes the search index updates queued by django-watson when WATSON_INDEX_QUEUE is enabled."
+    
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size",
+            type="int",
+            dest="batch_size",
+            default=100,
+            help="Number of queued objects to process in each transaction"),
+        make_option("--poll-interval",
+            type="float",
+            dest="poll_interval",
+            default=1.0,
+            help="Number of seconds to wait before checking an empty queue again"),
+        make_option("--once",
+            action="store_true",
+            default=False,
+            help="Exit once the queue is empty, instead of waiting for more updates"),
+    )
+    
+    def handle_noargs(self, **options):
+        """Runs the management command."""
+        verbosity = int(options.get("verbosity", 1))
+        processed_count = 0
+        while True:
+            # Reconnect if the database connection has expired or been dropped, unless the
+            # worker has been called inside a transaction.
+            if not connection.in_atomic_block:
+                close_old_connections()
+            batch_count = process_queue_batch(options["batch_size"])
+            processed_count += batch_count
+            if batch_count:
+                if verbosity >= 2:
+                    self.stdout.write("Processed {batch_count} queued search entry update(s).\n".format(
+                        batch_count = batch_count,
+                    ))
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["poll_interval"])
+        if verbosity >= 1:
+            self.stdout.write("Processed {processed_count} queued search entry update(s).\n".format(
+                processed_count = processed_count,
+            ))
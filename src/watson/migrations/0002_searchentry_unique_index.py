@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def install_unique_index(apps, schema_editor):
+    from watson.backends import install_unique_index
+    install_unique_index()
+
+
+def uninstall_unique_index(apps, schema_editor):
+    from watson.backends import uninstall_unique_index
+    uninstall_unique_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watson', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            install_unique_index,
+            uninstall_unique_index,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0001_initial'),
+        ('watson', '0002_searchentry_unique_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexBuild',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('engine_slug', models.CharField(default='default', max_length=200)),
+                ('built_at', models.DateTimeField()),
+                ('content_type', models.ForeignKey(to='contenttypes.ContentType')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchindexbuild',
+            unique_together=set([('engine_slug', 'content_type')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watson', '0003_searchindexbuild'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchentry',
+            name='content_hash',
+            field=models.CharField(max_length=40, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def install_queue_index(apps, schema_editor):
+    from watson.backends import install_queue_index
+    install_queue_index()
+
+
+def uninstall_queue_index(apps, schema_editor):
+    from watson.backends import uninstall_queue_index
+    uninstall_queue_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0001_initial'),
+        ('watson', '0004_searchentry_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueueEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('engine_slug', models.CharField(default='default', max_length=200)),
+                ('object_id', models.TextField()),
+                ('content_type', models.ForeignKey(to='contenttypes.ContentType')),
+            ],
+            options={
+                'verbose_name_plural': 'search queue entries',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(
+            install_queue_index,
+            uninstall_queue_index,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watson', '0005_searchqueueentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchentry',
+            name='is_live',
+            field=models.BooleanField(default=True, db_index=True),
+            preserve_default=True,
+        ),
+    ]
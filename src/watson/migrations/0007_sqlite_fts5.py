@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def install_sqlite_fts5(apps, schema_editor):
+    from watson.backends import install_sqlite_fts5
+    install_sqlite_fts5()
+
+
+def uninstall_sqlite_fts5(apps, schema_editor):
+    from watson.backends import uninstall_sqlite_fts5
+    uninstall_sqlite_fts5()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watson', '0006_searchentry_is_live'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            install_sqlite_fts5,
+            uninstall_sqlite_fts5,
+        ),
+    ]
@@ -2,11 +2,15 @@
 
 from __future__ import unicode_literals
 
-import json
+import json, hashlib
+from collections import defaultdict
+from itertools import islice
 
 from django.db import models
+from django.db.models.query import QuerySet
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
+from django.utils.encoding import force_text
 
 def has_int_pk(model):
     """Tests whether the given model has an integer primary key."""
@@ -21,9 +25,244 @@ def has_int_pk(model):
     )
     
     
+def get_content_hash(*values):
+    """Returns a hash of the given indexed content, used to skip writing unchanged search entries."""
+    return hashlib.sha1("\0".join(
+        force_text(value)
+        for value in values
+    ).encode("utf-8")).hexdigest()
+    
+    
 META_CACHE_KEY = "_meta_cache"
 
 
+class SearchEntryQuerySet(QuerySet):
+
+    """A queryset of search entries, which can load their referenced objects in bulk."""
+    
+    _with_objects = False
+    
+    # The number of search entries whose objects are loaded at a time.
+    _with_objects_batch_size = 100
+    
+    def with_objects(self):
+        """
+        Returns a copy of this queryset that loads the objects referenced by its search
+        entries with one query per model for each batch of search entries, applying the
+        select_related lookups of each model's search adapter.
+        
+        Search entries whose objects no longer exist are dropped.
+        """
+        return self._clone(_with_objects=True)
+    
+    # The (id, watson_rank) pairs of cached search results, in order. If set, iterating over or
+    # counting this queryset only fetches the search entries in the current slice by id.
+    _cached_results = None
+    
+    # A (sql, params) filter that the search entries of cached search results must still match
+    # when fetched, such as the live filters of the searched models, which can change without
+    # changing the search index.
+    _cached_results_filter = None
+    
+    # The number of cached search results fetched at a time.
+    _cached_results_batch_size = 500
+    
+    # The strategy used to count the search entries, or None to count them exactly.
+    _count_strategy = None
+    
+    _count_limit = None
+    
+    def with_count_strategy(self, count_strategy, count_limit=None):
+        """
+        Returns a copy of this queryset that is counted using the given count strategy,
+        one of "exact", "capped" or "estimate", and returns a ResultCount from count().
+        """
+        return self._clone(_count_strategy=count_strategy, _count_limit=count_limit)
+    
+    # The queryset of all search entries that could have been ranked, and the number of candidates
+    # that were actually ranked, if two-phase ranking was used.
+    _candidates = None
+    
+    def _with_candidates(self, queryset, candidate_limit):
+        """Returns a copy of this queryset that was restricted to candidates from the given queryset."""
+        return self._clone(_candidates=(queryset, candidate_limit))
+    
+    def is_ranking_truncated(self):
+        """
+        Checks whether two-phase ranking left out any matching search entries, because there
+        were more than the candidate limit.
+        """
+        if self._candidates is None:
+            return False
+        queryset, candidate_limit = self._candidates
+        return bool(list(queryset.order_by().values_list("id", flat=True)[candidate_limit:candidate_limit + 1]))
+    
+    def _with_cached_results(self, cached_results, cached_results_filter=None):
+        """
+        Returns a copy of this queryset that uses the given cached search results, skipping
+        any search entries that no longer match the given (sql, params) filter.
+        """
+        return self._clone(_cached_results=cached_results, _cached_results_filter=cached_results_filter)
+    
+    def _clone(self, klass=None, setup=False, **kwargs):
+        """
+        Copies this queryset, including whether it loads referenced objects and any cached
+        search results.
+        """
+        kwargs.setdefault("_with_objects", self._with_objects)
+        kwargs.setdefault("_count_strategy", self._count_strategy)
+        kwargs.setdefault("_count_limit", self._count_limit)
+        kwargs.setdefault("_candidates", self._candidates)
+        if klass is None:
+            kwargs.setdefault("_cached_results", self._cached_results)
+            kwargs.setdefault("_cached_results_filter", self._cached_results_filter)
+        return super(SearchEntryQuerySet, self)._clone(klass=klass, setup=setup, **kwargs)
+    
+    def _without_cached_results(self):
+        """Returns a copy of this queryset that runs its query, rather than using any cached search results."""
+        return self._clone(_cached_results=None, _cached_results_filter=None)
+    
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        """Filters this queryset, which can no longer use cached search results."""
+        return super(SearchEntryQuerySet, self._without_cached_results())._filter_or_exclude(negate, *args, **kwargs)
+    
+    def extra(self, *args, **kwargs):
+        """Adds extra SQL to this queryset, which can no longer use cached search results."""
+        return super(SearchEntryQuerySet, self._without_cached_results()).extra(*args, **kwargs)
+    
+    def order_by(self, *field_names):
+        """Reorders this queryset, which can no longer use cached search results."""
+        return super(SearchEntryQuerySet, self._without_cached_results()).order_by(*field_names)
+    
+    def distinct(self, *field_names):
+        """Makes this queryset distinct, which can no longer use cached search results."""
+        return super(SearchEntryQuerySet, self._without_cached_results()).distinct(*field_names)
+    
+    def annotate(self, *args, **kwargs):
+        """Annotates this queryset, which can no longer use cached search results."""
+        return super(SearchEntryQuerySet, self._without_cached_results()).annotate(*args, **kwargs)
+    
+    def none(self):
+        """Returns an empty queryset, which can no longer use cached search results."""
+        return super(SearchEntryQuerySet, self._without_cached_results()).none()
+    
+    def reverse(self):
+        """Reverses this queryset, which can no longer use cached search results."""
+        return super(SearchEntryQuerySet, self._without_cached_results()).reverse()
+    
+    def _get_cached_results_slice(self):
+        """Returns the cached search results in the current slice of this queryset."""
+        return self._cached_results[self.query.low_mark:self.query.high_mark]
+    
+    def count(self):
+        """
+        Counts the search entries, using any cached search results or count strategy.
+        
+        Counts of cached search results include any search entries deleted, or no longer
+        live, since the search results were cached.
+        """
+        if self._result_cache is None:
+            if self._cached_results is not None:
+                return len(self._get_cached_results_slice())
+            if self._count_strategy is not None:
+                from watson.backends import count_results
+                return count_results(self._clone(_count_strategy=None), self._count_strategy, self._count_limit)
+        return super(SearchEntryQuerySet, self).count()
+    
+    def exists(self):
+        """Checks whether there are any search entries, using any cached search results."""
+        if self._cached_results is not None and self._result_cache is None:
+            return bool(self._get_cached_results_slice())
+        return super(SearchEntryQuerySet, self).exists()
+    
+    def _iter_cached_results(self):
+        """Fetches the search entries in the current slice of the cached search results by id, in order."""
+        queryset = self.model._base_manager.using(self.db)
+        if self._cached_results_filter is not None:
+            sql, params = self._cached_results_filter
+            queryset = queryset.extra(
+                where = (sql,),
+                params = params,
+            )
+        cached_results = self._get_cached_results_slice()
+        for index in range(0, len(cached_results), self._cached_results_batch_size):
+            cached_results_batch = cached_results[index:index + self._cached_results_batch_size]
+            search_entries = queryset.in_bulk([pk for pk, rank in cached_results_batch])
+            for pk, rank in cached_results_batch:
+                search_entry = search_entries.get(pk)
+                # Skip search entries deleted, or no longer live, since the search results were cached.
+                if search_entry is None:
+                    continue
+                if rank is not None:
+                    search_entry.watson_rank = rank
+                yield search_entry
+    
+    def _attach_objects(self, search_entries):
+        """
+        Loads and attaches the objects referenced by the given search entries, returning the
+        search entries whose objects exist.
+        """
+        from watson.registration import SearchEngine
+        search_engines = dict(SearchEngine.get_created_engines())
+        # Group the object ids by content type and search engine.
+        object_ids = defaultdict(set)
+        for search_entry in search_entries:
+            object_ids[(search_entry.content_type_id, search_entry.engine_slug)].add(search_entry.object_id)
+        # Load the objects in bulk.
+        objs = {}
+        for (content_type_id, engine_slug), object_id_set in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            queryset = model._base_manager.all()
+            search_engine = search_engines.get(engine_slug)
+            if search_engine is not None and search_engine.is_registered(model):
+                select_related = search_engine.get_adapter(model).get_select_related()
+                if select_related:
+                    queryset = queryset.select_related(*select_related)
+            for pk, obj in queryset.in_bulk(list(object_id_set)).items():
+                objs[(content_type_id, force_text(pk))] = obj
+        # Attach the objects to the search entries.
+        cache_attr = SearchEntry.object.cache_attr
+        search_entries_with_objects = []
+        for search_entry in search_entries:
+            obj = objs.get((search_entry.content_type_id, search_entry.object_id))
+            if obj is not None:
+                setattr(search_entry, cache_attr, obj)
+                search_entries_with_objects.append(search_entry)
+        return search_entries_with_objects
+    
+    def iterator(self):
+        """Iterates over the search entries, loading their referenced objects if requested."""
+        if self._cached_results is None:
+            search_entries = super(SearchEntryQuerySet, self).iterator()
+        else:
+            search_entries = self._iter_cached_results()
+        if not self._with_objects:
+            for search_entry in search_entries:
+                yield search_entry
+            return
+        while True:
+            search_entry_batch = list(islice(search_entries, self._with_objects_batch_size))
+            if not search_entry_batch:
+                break
+            for search_entry in self._attach_objects(search_entry_batch):
+                yield search_entry
+
+
+class SearchEntryManager(models.Manager):
+
+    """Manager for search entries."""
+    
+    def get_queryset(self):
+        """Returns a queryset of search entries, which can load their referenced objects in bulk."""
+        return SearchEntryQuerySet(self.model, using=self._db)
+    
+    def with_objects(self):
+        """Returns all search entries, loading their referenced objects in bulk."""
+        return self.get_queryset().with_objects()
+
+
 class SearchEntry(models.Model):
 
     """An entry in the search index."""
@@ -67,6 +306,22 @@ class SearchEntry(models.Model):
     
     meta_encoded = models.TextField()
     
+    content_hash = models.CharField(
+        max_length = 40,
+        blank = True,
+    )
+    
+    is_live = models.BooleanField(
+        default = True,
+        db_index = True,
+    )
+    
+    objects = SearchEntryManager()
+    
+    def get_content_hash(self):
+        """Returns a hash of the indexed content, used to skip writing unchanged search entries."""
+        return get_content_hash(self.title, self.description, self.content, self.url, self.meta_encoded)
+    
     @property
     def meta(self):
         """Returns the meta information stored with the search entry."""
@@ -88,3 +343,56 @@ class SearchEntry(models.Model):
         
     class Meta:
         verbose_name_plural = "search entries"
+
+
+class SearchIndexBuild(models.Model):
+
+    """Records when the search index for a model was last successfully rebuilt."""
+    
+    engine_slug = models.CharField(
+        max_length = 200,
+        default = "default",
+    )
+    
+    content_type = models.ForeignKey(
+        ContentType,
+    )
+    
+    built_at = models.DateTimeField()
+    
+    def __unicode__(self):
+        """Returns a unicode representation."""
+        return "{content_type} in {engine_slug!r} search engine".format(
+            content_type = self.content_type,
+            engine_slug = self.engine_slug,
+        )
+        
+    class Meta:
+        unique_together = (("engine_slug", "content_type",),)
+
+
+class SearchQueueEntry(models.Model):
+
+    """An object waiting for its search entry to be updated by the watsonworker command."""
+    
+    engine_slug = models.CharField(
+        max_length = 200,
+        default = "default",
+    )
+    
+    content_type = models.ForeignKey(
+        ContentType,
+    )
+    
+    object_id = models.TextField()
+    
+    def __unicode__(self):
+        """Returns a unicode representation."""
+        return "{content_type} {object_id} in {engine_slug!r} search engine".format(
+            content_type = self.content_type,
+            object_id = self.object_id,
+            engine_slug = self.engine_slug,
+        )
+        
+    class Meta:
+        verbose_name_plural = "search queue entries"
@@ -2,7 +2,9 @@
 
 from __future__ import unicode_literals
 
-import sys, json
+import sys, json, time, hashlib
+from bisect import bisect_right
+from collections import defaultdict
 from itertools import chain, islice
 from threading import local
 from functools import wraps
@@ -11,16 +13,22 @@ from weakref import WeakValueDictionary
 from django.conf import settings
 from django.core.signals import request_finished
 from django.core.exceptions import ImproperlyConfigured
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    from django.db.models.sql.datastructures import EmptyResultSet
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
 from django.db.models.query import QuerySet
 from django.db.models.signals import post_save, pre_delete
 from django.utils.encoding import force_text
 from django.utils.html import strip_tags
 from django.utils.importlib import import_module
 
-from watson.models import SearchEntry, has_int_pk
+from watson.backends import SEARCH_ENTRY_COLUMNS, SEARCH_ENTRY_DATA_COLUMNS, SEARCH_ENTRY_KEY_HASH_COLUMN, bulk_upsert_search_entries, can_upsert, get_object_id_sql
+from watson.models import SearchEntry, SearchQueueEntry, has_int_pk, get_content_hash
 
 
 class SearchAdapterError(Exception):
@@ -28,6 +36,28 @@ class SearchAdapterError(Exception):
     """Something went wrong with a search adapter."""
 
 
+class CompiledSearchAdapter(object):
+
+    """The field accessors of a search adapter, compiled when its model is registered."""
+    
+    def __init__(self, model, has_int_pk, content_accessors, store_accessors):
+        """Initializes the compiled search adapter."""
+        self.model = model
+        self.has_int_pk = has_int_pk
+        self.content_accessors = content_accessors
+        self.store_accessors = store_accessors
+        self._content_type_id = None
+    
+    def get_content_type_id(self):
+        """
+        Returns the content type id of the model. This is looked up on first use, since the
+        database may not be ready when models are registered.
+        """
+        if self._content_type_id is None:
+            self._content_type_id = ContentType.objects.get_for_model(self.model).id
+        return self._content_type_id
+
+
 class SearchAdapter(object):
 
     """An adapter for performing a full-text search on a model."""
@@ -41,9 +71,98 @@ class SearchAdapter(object):
     # Use to specify object properties to be stored in the search index.
     store = ()
     
+    # Use to specify a date/time field that is updated whenever an object is modified,
+    # allowing buildwatson to incrementally rebuild the search index.
+    modified_field = None
+    
+    # Use to specify the related objects loaded using select_related when indexing. If None,
+    # these are worked out from the fields and store.
+    select_related = None
+    
+    # Use to specify the related objects loaded using prefetch_related when indexing. If None,
+    # these are worked out from the fields and store.
+    prefetch_related = None
+    
+    # Use to evaluate the live queryset when objects are indexed, storing the result on their
+    # search entries, so that searches filter on a column instead of the live queryset. Run
+    # buildwatson --refresh-live periodically if the live queryset depends on the time.
+    store_is_live = False
+    
     def __init__(self, model):
         """Initializes the search adapter."""
         self.model = model
+        self._related_lookups = None
+        self._compiled = None
+    
+    def _get_relation(self, model, name):
+        """
+        Returns a tuple of (related_model, is_to_many) for the named relation of the given
+        model, or None if the name is not a relation.
+        """
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            pass
+        else:
+            if field.rel is None:
+                return None
+            return field.rel.to, isinstance(field, models.ManyToManyField)
+        for related in model._meta.get_all_related_objects() + model._meta.get_all_related_many_to_many_objects():
+            if related.get_accessor_name() == name:
+                return related.model, not isinstance(related.field, models.OneToOneField)
+        return None
+    
+    def _get_related_lookups(self):
+        """
+        Works out the select_related and prefetch_related lookups needed to resolve the
+        fields and store of this adapter.
+        """
+        if self._related_lookups is None:
+            select_related = set()
+            prefetch_related = set()
+            for name in chain(self._get_content_field_names(), self.store):
+                model = self.model
+                path = []
+                is_to_many = False
+                for part in name.split("__"):
+                    relation = self._get_relation(model, part)
+                    if relation is None:
+                        break
+                    model, is_part_to_many = relation
+                    is_to_many = is_to_many or is_part_to_many
+                    path.append(part)
+                if path:
+                    if is_to_many:
+                        prefetch_related.add("__".join(path))
+                    else:
+                        select_related.add("__".join(path))
+            self._related_lookups = (sorted(select_related), sorted(prefetch_related))
+        return self._related_lookups
+    
+    def get_select_related(self):
+        """Returns the related objects that should be loaded using select_related when indexing."""
+        if self.select_related is not None:
+            return list(self.select_related)
+        return self._get_related_lookups()[0]
+    
+    def get_prefetch_related(self):
+        """Returns the related objects that should be loaded using prefetch_related when indexing."""
+        if self.prefetch_related is not None:
+            return list(self.prefetch_related)
+        return self._get_related_lookups()[1]
+    
+    def get_index_queryset(self, queryset):
+        """
+        Returns the given queryset of this adapter's model, loading the related objects
+        needed to render search entries in a fixed number of queries.
+        """
+        select_related = self.get_select_related()
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        prefetch_related = self.get_prefetch_related()
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
     
     def _resolve_field(self, obj, name):
         """Resolves the content of the given model field."""
@@ -79,6 +198,82 @@ class SearchAdapter(object):
         # Resolution complete!
         return value
     
+    def _compile_accessor(self, model, name):
+        """
+        Compiles a function that resolves the content of the given field for objects of the
+        given model, working out up front where each part of the field name is looked up.
+        
+        If the field cannot be found on the model class, it may still be set on each instance,
+        such as by __init__ or an annotation, so instance attributes are checked before falling
+        back to the adapter. If the model is None, or the field cannot be found on either the
+        model class or the adapter, the field is resolved dynamically using _resolve_field.
+        """
+        if model is None:
+            return lambda obj: self._resolve_field(obj, name)
+        prefix, _, suffix = name.partition("__")
+        # Work out where to look up the attribute.
+        if prefix in set(chain.from_iterable((field.name, field.attname) for field in model._meta.fields)):
+            get_value = lambda obj: getattr(obj, prefix)
+        elif hasattr(model, prefix):
+            def get_value(obj):
+                value = getattr(obj, prefix)
+                if not isinstance(value, (QuerySet, models.Manager)):
+                    if callable(value):
+                        value = value()
+                return value
+        elif hasattr(self, prefix):
+            adapter_value = getattr(self, prefix)
+            def get_value(obj):
+                if hasattr(obj, prefix):
+                    value = getattr(obj, prefix)
+                    if not isinstance(value, (QuerySet, models.Manager)):
+                        if callable(value):
+                            value = value()
+                    return value
+                value = adapter_value
+                if not isinstance(value, (QuerySet, models.Manager)):
+                    if callable(value):
+                        value = value(obj)
+                return value
+        else:
+            return lambda obj: self._resolve_field(obj, name)
+        # Compile the accessor for recursive fields.
+        if suffix:
+            relation = self._get_relation(model, prefix)
+            resolve_suffix = self._compile_accessor(relation and relation[0], suffix)
+        def accessor(obj):
+            if obj is None:
+                return ""
+            value = get_value(obj)
+            # Look up recursive fields.
+            if suffix:
+                if isinstance(value, (QuerySet, models.Manager)):
+                    return " ".join(force_text(resolve_suffix(related)) for related in value.all())
+                return resolve_suffix(value)
+            # Resolve querysets.
+            if isinstance(value, (QuerySet, models.Manager)):
+                value = " ".join(force_text(related) for related in value.all())
+            return value
+        return accessor
+    
+    def _compile(self):
+        """Compiles the field accessors of this adapter, when its model is registered."""
+        self._compiled = CompiledSearchAdapter(
+            self.model,
+            has_int_pk(self.model),
+            [self._compile_accessor(self.model, field_name) for field_name in self._get_content_field_names()],
+            [(field_name, self._compile_accessor(self.model, field_name)) for field_name in self.store],
+        )
+    
+    def _get_compiled(self):
+        """
+        Returns the compiled field accessors of this adapter. Adapters that were never
+        registered are compiled on first use.
+        """
+        if self._compiled is None:
+            self._compile()
+        return self._compiled
+    
     def prepare_content(self, content):
         """Sanitizes the given content string for better parsing by the search engine."""
         # Strip out HTML tags.
@@ -116,16 +311,19 @@ class SearchAdapter(object):
         
         The default implementation returns all the registered fields in your model joined together.
         """
-        # Get the field names to look up.
-        field_names = self.fields or (field.name for field in self.model._meta.fields if isinstance(field, (models.CharField, models.TextField)))
-        # Exclude named fields.
-        field_names = (field_name for field_name in field_names if field_name not in self.exclude)
         # Create the text.
         return self.prepare_content(" ".join(
-            force_text(self._resolve_field(obj, field_name))
-            for field_name in field_names
+            force_text(accessor(obj))
+            for accessor in self._get_compiled().content_accessors
         ))
     
+    def _get_content_field_names(self):
+        """Returns the names of the fields used to create the content of search entries."""
+        # Get the field names to look up.
+        field_names = self.fields or (field.name for field in self.model._meta.fields if isinstance(field, (models.CharField, models.TextField)))
+        # Exclude named fields.
+        return (field_name for field_name in field_names if field_name not in self.exclude)
+    
     def get_url(self, obj):
         """Return the URL of the given obj."""
         if hasattr(obj, "get_absolute_url"):
@@ -135,8 +333,8 @@ class SearchAdapter(object):
     def get_meta(self, obj):
         """Returns a dictionary of meta information about the given obj."""
         return dict(
-            (field_name, self._resolve_field(obj, field_name))
-            for field_name in self.store
+            (field_name, accessor(obj))
+            for field_name, accessor in self._get_compiled().store_accessors
         )
         
     def get_live_queryset(self):
@@ -146,6 +344,31 @@ class SearchAdapter(object):
         If this returns None, then all objects should be considered live, which is more efficient.
         """
         return None
+    
+    def is_live(self, obj):
+        """
+        Returns whether the given object is live, when store_is_live is set.
+        
+        This checks the object against the live queryset. Override it with an equivalent check
+        of the object's attributes to avoid a query for each saved object.
+        """
+        live_queryset = self.get_live_queryset()
+        if live_queryset is None:
+            return True
+        return live_queryset.filter(pk=obj.pk).exists()
+    
+    def get_live_pks(self, objs):
+        """
+        Returns the set of primary keys of the given objects that are live, when store_is_live
+        is set.
+        
+        This is used when indexing objects in bulk, and checks all the objects against the
+        live queryset in a single query.
+        """
+        live_queryset = self.get_live_queryset()
+        if live_queryset is None:
+            return set(obj.pk for obj in objs)
+        return set(live_queryset.filter(pk__in=[obj.pk for obj in objs]).values_list("pk", flat=True))
 
 
 class SearchEngineError(Exception):
@@ -163,19 +386,353 @@ class SearchContextError(Exception):
     """Something went wrong with the search context management."""
 
 
+def _save_search_entry_batch(search_entries):
+    """
+    Creates or updates the given search entries one at a time, for databases that
+    do not support upserts.
+    """
+    new_search_entries = []
+    for search_entry in search_entries:
+        existing_search_entries = SearchEntry.objects.filter(
+            engine_slug = search_entry.engine_slug,
+            content_type_id = search_entry.content_type_id,
+        )
+        if search_entry.object_id_int is None:
+            existing_search_entries = existing_search_entries.filter(
+                object_id = search_entry.object_id,
+            )
+        else:
+            existing_search_entries = existing_search_entries.filter(
+                object_id_int = search_entry.object_id_int,
+            )
+        update_count = existing_search_entries.update(**dict(
+            (column, getattr(search_entry, column))
+            for column in SEARCH_ENTRY_DATA_COLUMNS
+        ))
+        if update_count == 0:
+            new_search_entries.append(search_entry)
+        elif update_count > 1:
+            # Oh no! Somehow we've got duplicated search entries!
+            existing_search_entries.exclude(
+                id = existing_search_entries.order_by("id").values_list("id", flat=True)[0],
+            ).delete()
+    if new_search_entries:
+        SearchEntry.objects.bulk_create(new_search_entries)
+
+
+def _create_key_filter(keys):
+    """
+    Creates a filter matching the given (engine_slug, content_type_id, object_id) keys, such
+    as those of queue entries. Search entries should use _create_search_entry_filter.
+    """
+    object_ids = defaultdict(list)
+    for engine_slug, content_type_id, object_id in keys:
+        object_ids[(engine_slug, content_type_id)].append(object_id)
+    key_filter = Q()
+    for (engine_slug, content_type_id), object_id_list in object_ids.items():
+        key_filter |= Q(
+            engine_slug = engine_slug,
+            content_type_id = content_type_id,
+            object_id__in = object_id_list,
+        )
+    return key_filter
+
+
+def _create_search_entry_filter(search_entries):
+    """
+    Creates a SQL filter matching the stored copies of the given search entries, returning
+    a (sql, params) pair.
+    
+    Integer object ids are matched using the indexed object_id_int column. Other object ids
+    are matched using the hashed key of the MySQL unique index, where installed, and
+    otherwise using object_id, which is only indexed by the unique index.
+    """
+    db_table = connection.ops.quote_name(SearchEntry._meta.db_table)
+    object_ids = defaultdict(list)
+    key_hashes = []
+    for search_entry in search_entries:
+        if search_entry.object_id_int is not None:
+            object_ids[(search_entry.engine_slug, search_entry.content_type_id, "object_id_int")].append(search_entry.object_id_int)
+        elif connection.vendor == "mysql" and can_upsert():
+            key_hashes.append(search_entry)
+        else:
+            object_ids[(search_entry.engine_slug, search_entry.content_type_id, "object_id")].append(search_entry.object_id)
+    filters = []
+    params = []
+    for (engine_slug, content_type_id, column), object_id_list in object_ids.items():
+        filters.append("({db_table}.engine_slug = %s AND {db_table}.content_type_id = %s AND {db_table}.{column} IN ({placeholders}))".format(
+            db_table = db_table,
+            column = column,
+            placeholders = ", ".join(["%s"] * len(object_id_list)),
+        ))
+        params.extend([engine_slug, content_type_id])
+        params.extend(object_id_list)
+    if key_hashes:
+        filters.append("{db_table}.{column} IN ({key_hashes})".format(
+            db_table = db_table,
+            column = SEARCH_ENTRY_KEY_HASH_COLUMN,
+            key_hashes = ", ".join(["UNHEX(SHA1(CONCAT_WS(CHAR(0), %s, %s, %s)))"] * len(key_hashes)),
+        ))
+        for search_entry in key_hashes:
+            params.extend([search_entry.engine_slug, search_entry.content_type_id, search_entry.object_id])
+    if not filters:
+        return "1 = 0", ()
+    return " OR ".join(filters), tuple(params)
+
+
+def _get_changed_search_entries(search_entries):
+    """
+    Returns the given search entries, minus any whose stored content hash shows that
+    they are unchanged, using a single query.
+    """
+    search_entries_by_key = dict(
+        ((search_entry.engine_slug, search_entry.content_type_id, search_entry.object_id), search_entry)
+        for search_entry in search_entries
+    )
+    # Look up the existing content hashes.
+    search_entry_filter = _create_search_entry_filter(search_entries_by_key.values())
+    existing_search_entries = SearchEntry.objects.extra(
+        where = (search_entry_filter[0],),
+        params = search_entry_filter[1],
+    ).values_list("engine_slug", "content_type_id", "object_id", "content_hash", "is_live")
+    # Skip the unchanged search entries. Duplicated search entries are always saved, so
+    # that the duplicates get removed.
+    existing_counts = {}
+    unchanged_keys = set()
+    for engine_slug, content_type_id, object_id, content_hash, is_live in existing_search_entries:
+        key = (engine_slug, content_type_id, object_id)
+        search_entry = search_entries_by_key.get(key)
+        if search_entry is not None:
+            existing_counts[key] = existing_counts.get(key, 0) + 1
+            if search_entry.content_hash == content_hash and search_entry.is_live == is_live:
+                unchanged_keys.add(key)
+    return [
+        search_entry
+        for key, search_entry in search_entries_by_key.items()
+        if key not in unchanged_keys or existing_counts[key] > 1
+    ]
+
+
+def _create_object_filter(queryset):
+    """
+    Creates a SQL filter matching the search entries of the objects in the given queryset,
+    returning a (sql, params) pair. The queryset is compiled into a subquery.
+    
+    Raises EmptyResultSet if the queryset cannot match anything.
+    """
+    db_table = connection.ops.quote_name(SearchEntry._meta.db_table)
+    model = queryset.model
+    sub_sql, sub_params = queryset.order_by().values_list("pk", flat=True).query.sql_with_params()
+    if has_int_pk(model):
+        return "{db_table}.object_id_int IN ({sub_sql})".format(
+            db_table = db_table,
+            sub_sql = sub_sql,
+        ), tuple(sub_params)
+    return "{db_table}.object_id IN (SELECT {object_id_sql} FROM ({sub_sql}) watson_live)".format(
+        db_table = db_table,
+        object_id_sql = get_object_id_sql("watson_live.{column}".format(
+            column = connection.ops.quote_name(model._meta.pk.column),
+        ), model),
+        sub_sql = sub_sql,
+    ), tuple(sub_params)
+
+
 def _bulk_save_search_entries(search_entries, batch_size=100):
-    """Creates the given search entry data in the most efficient way possible."""
-    if search_entries:
-        if hasattr(SearchEntry.objects, "bulk_create"):
-            search_entries = iter(search_entries)
-            while True:
-                search_entry_batch = list(islice(search_entries, 0, batch_size))
-                if not search_entry_batch:
-                    break
-                SearchEntry.objects.bulk_create(search_entry_batch)
+    """
+    Creates or updates the given search entries in the most efficient way possible.
+
+    Each batch costs a single query to skip unchanged search entries, then, where the
+    database supports it and the unique index is installed, a single upsert statement.
+    """
+    search_entries = iter(search_entries)
+    engine_slugs = set()
+    while True:
+        search_entry_batch = list(islice(search_entries, 0, batch_size))
+        if not search_entry_batch:
+            break
+        search_entry_batch = _get_changed_search_entries(search_entry_batch)
+        if not search_entry_batch:
+            continue
+        if can_upsert():
+            bulk_upsert_search_entries(search_entry_batch)
         else:
-            for search_entry in search_entries:
-                search_entry.save()
+            _save_search_entry_batch(search_entry_batch)
+        engine_slugs.update(search_entry.engine_slug for search_entry in search_entry_batch)
+    invalidate_search_cache(engine_slugs)
+
+
+def _iter_chunks(queryset, chunk_size):
+    """Yields lists of objects from the given queryset, using keyset pagination on the primary key."""
+    queryset = queryset.order_by("pk")
+    last_pk = None
+    while True:
+        if last_pk is None:
+            chunk = list(queryset[:chunk_size])
+        else:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        last_pk = chunk[-1].pk
+
+
+def is_index_queue_enabled():
+    """
+    Checks whether search index updates should be added to the database queue, to be
+    processed asynchronously by the watsonworker command.
+    """
+    return getattr(settings, "WATSON_INDEX_QUEUE", False)
+
+
+def is_flush_on_commit_enabled():
+    """
+    Checks whether search contexts that end inside a transaction should leave their
+    updates pending until the transaction has been committed.
+    
+    This needs on-commit callbacks (Django 1.9+), since otherwise nothing would flush the
+    updates of code that runs outside a request, such as management commands.
+    """
+    flush_on_commit = getattr(settings, "WATSON_FLUSH_ON_COMMIT", False)
+    if flush_on_commit and not hasattr(transaction, "on_commit"):
+        raise ImproperlyConfigured("WATSON_FLUSH_ON_COMMIT requires on-commit callbacks, which were added in Django 1.9.")
+    return flush_on_commit
+
+
+def get_search_cache():
+    """Returns the cache used to store search results, or None if search result caching is disabled."""
+    cache_alias = getattr(settings, "WATSON_SEARCH_CACHE", None)
+    if cache_alias is None:
+        return None
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        from django.core.cache import get_cache
+        return get_cache(cache_alias)
+    return caches[cache_alias]
+
+
+def _get_search_generation_key(engine_slug):
+    """Returns the cache key of the generation counter for the given search engine."""
+    return "watson:generation:{engine_slug}".format(
+        engine_slug = hashlib.sha1(engine_slug.encode("utf-8")).hexdigest(),
+    )
+
+
+def _get_search_generation(cache, engine_slug):
+    """
+    Returns the generation counter for the given search engine.
+    
+    A missing counter is seeded from the clock, so that it never returns to a generation
+    that already has cached search results.
+    """
+    generation_key = _get_search_generation_key(engine_slug)
+    generation = cache.get(generation_key)
+    if generation is None:
+        generation = int(time.time() * 1000)
+        cache.add(generation_key, generation)
+        generation = cache.get(generation_key, generation)
+    return generation
+
+
+def _bump_search_generations(cache, engine_slugs):
+    """Increments the generation counters for the given search engines."""
+    for engine_slug in engine_slugs:
+        try:
+            cache.incr(_get_search_generation_key(engine_slug))
+        except ValueError:
+            # A missing counter will be seeded with a new generation.
+            pass
+
+
+class _DirtySearchEngines(local):
+
+    """The search engines whose search index was written to inside the current transaction."""
+
+    def __init__(self):
+        """Initializes the dirty search engines."""
+        self.engine_slugs = set()
+
+
+_dirty_search_engines = _DirtySearchEngines()
+
+
+def _end_dirty_search_engines(**kwargs):
+    """
+    Invalidates the search engines written to by a transaction that has since ended, since
+    other threads may have cached the old search results before it committed.
+    """
+    if not _dirty_search_engines.engine_slugs or connection.in_atomic_block:
+        return
+    cache = get_search_cache()
+    if cache is not None:
+        _bump_search_generations(cache, _dirty_search_engines.engine_slugs)
+    _dirty_search_engines.engine_slugs = set()
+
+
+request_finished.connect(_end_dirty_search_engines)
+
+
+def invalidate_search_cache(engine_slugs):
+    """
+    Invalidates the cached search results of the given search engines.
+    
+    Inside a transaction, the search engines are marked as dirty. They skip the search
+    cache until the transaction ends, and are then invalidated again on commit where the
+    database connection supports on-commit callbacks (Django 1.9+), and otherwise by the
+    next search or the end of the request. Code that writes to the search index outside
+    of a request, such as a management command, should call _end_dirty_search_engines()
+    once its transaction has ended.
+    """
+    cache = get_search_cache()
+    engine_slugs = set(engine_slugs)
+    if cache is None or not engine_slugs:
+        return
+    _bump_search_generations(cache, engine_slugs)
+    if connection.in_atomic_block:
+        _dirty_search_engines.engine_slugs.update(engine_slugs)
+        # Callbacks are discarded when a transaction rolls back, so check that one is registered.
+        if hasattr(transaction, "on_commit") and not any(hook[1] == _end_dirty_search_engines for hook in connection.run_on_commit):
+            transaction.on_commit(_end_dirty_search_engines)
+
+
+def _queue_search_entries(tasks):
+    """Adds the given (engine, model, pk) keys to the database queue using a single statement."""
+    queue_entries = dict(
+        ((engine._engine_slug, ContentType.objects.get_for_model(model).id, force_text(pk)), None)
+        for engine, model, pk in tasks
+    )
+    if queue_entries:
+        SearchQueueEntry.objects.bulk_create([
+            SearchQueueEntry(
+                engine_slug = engine_slug,
+                content_type_id = content_type_id,
+                object_id = object_id,
+            )
+            for engine_slug, content_type_id, object_id in queue_entries
+        ])
+
+
+def _get_deleted_tasks(deleted_tasks):
+    """
+    Returns the given deleted (engine, model, pk) tasks whose objects no longer exist,
+    using a single query per model.
+    """
+    object_ids = defaultdict(list)
+    for engine, model, pk in deleted_tasks:
+        object_ids[model].append(pk)
+    existing_pks = set()
+    for model, object_id_list in object_ids.items():
+        existing_pks.update(
+            (model, pk)
+            for pk in model._base_manager.filter(pk__in=object_id_list).values_list("pk", flat=True)
+        )
+    return set(
+        (engine, model, pk)
+        for engine, model, pk in deleted_tasks
+        if (model, pk) not in existing_pks
+    )
 
 
 class SearchContextManager(local):
@@ -185,6 +742,8 @@ class SearchContextManager(local):
     def __init__(self):
         """Initializes the search context."""
         self._stack = []
+        # The (tasks, deleted_tasks) left pending by search contexts that ended inside a transaction.
+        self._pending = None
         # Connect to the signalling framework.
         request_finished.connect(self._request_finished_receiver)
     
@@ -199,33 +758,110 @@ class SearchContextManager(local):
         
     def start(self):
         """Starts a level in the search context."""
-        self._stack.append((set(), False))
+        self._stack.append((set(), set(), False))
     
     def add_to_context(self, engine, obj):
-        """Adds an object to the current context, if active."""
+        """
+        Adds an object to the current context, if active.
+        
+        Only the primary key of the object is kept, so each object is indexed once
+        from its saved state when the context ends.
+        """
+        self._assert_active()
+        objects, _, _ = self._stack[-1]
+        objects.add((engine, obj.__class__, obj.pk))
+    
+    def add_delete_to_context(self, engine, obj):
+        """
+        Adds a deleted object to the current context, if active.
+        
+        The search entries of deleted objects are removed in bulk when the context ends.
+        """
         self._assert_active()
-        objects, _ = self._stack[-1]
-        objects.add((engine, obj))
+        _, deleted_objects, _ = self._stack[-1]
+        deleted_objects.add((engine, obj.__class__, obj.pk))
     
     def invalidate(self):
         """Marks this search context as broken, so should not be commited."""
         self._assert_active()
-        objects, _ = self._stack[-1]
-        self._stack[-1] = (objects, True)
+        objects, deleted_objects, _ = self._stack[-1]
+        self._stack[-1] = (objects, deleted_objects, True)
         
     def is_invalid(self):
         """Checks whether this search context is invalid."""
         self._assert_active()
-        _, is_invalid = self._stack[-1]
+        _, _, is_invalid = self._stack[-1]
         return is_invalid
     
     def end(self):
         """Ends a level in the search context."""
         self._assert_active()
+        tasks, deleted_tasks, is_invalid = self._stack.pop()
+        # An invalid context only flushes the deletes that really happened, since the error
+        # may have rolled them back. The error may also have aborted the transaction, so
+        # they are left pending, and only checked once the transaction has ended.
+        if is_invalid:
+            self._defer_flush(set(), deleted_tasks)
+        elif is_flush_on_commit_enabled() and connection.in_atomic_block:
+            self._defer_flush(tasks, deleted_tasks)
+        else:
+            self._flush(tasks, deleted_tasks)
+        self._end_pending_flush()
+    
+    def _defer_flush(self, tasks, deleted_tasks):
+        """
+        Leaves the given tasks pending until the current transaction has ended, merged with
+        any other pending tasks, so each object is indexed once however many search contexts
+        and nested atomic blocks touched it.
+        
+        The pending tasks are flushed on commit where the database connection supports
+        on-commit callbacks (Django 1.9+). If the transaction is rolled back, or there are
+        no on-commit callbacks, they are flushed by the next search context to end outside
+        a transaction, or the end of the request.
+        """
+        if self._pending is None:
+            self._pending = (set(), set())
+        # Callbacks are discarded when a transaction rolls back, so check that one is registered.
+        if hasattr(transaction, "on_commit") and not any(hook[1] == self._end_pending_flush for hook in connection.run_on_commit):
+            transaction.on_commit(self._end_pending_flush)
+        pending_tasks, pending_deleted_tasks = self._pending
+        pending_tasks.update(tasks)
+        pending_deleted_tasks.update(deleted_tasks)
+    
+    def _end_pending_flush(self):
+        """
+        Flushes the pending tasks, once the transaction they were left pending in has ended.
+        
+        The transaction may have been rolled back, so deletes are only flushed for objects
+        that no longer exist. Updates are safe to flush either way, since objects are
+        indexed from their saved state.
+        """
+        if self._pending is None or connection.in_atomic_block:
+            return
+        tasks, deleted_tasks = self._pending
+        self._pending = None
+        self._flush(tasks, _get_deleted_tasks(deleted_tasks))
+    
+    def _flush(self, tasks, deleted_tasks):
+        """Saves the search entries of the given tasks, and deletes those of the deleted tasks."""
+        # Delete the search entries of deleted objects.
+        object_ids = defaultdict(list)
+        for engine, model, pk in deleted_tasks:
+            object_ids[(engine, model)].append(pk)
+        for (engine, model), object_id_list in object_ids.items():
+            engine.delete_pks_index(model, object_id_list)
         # Save all the models.
-        tasks, is_invalid = self._stack.pop()
-        if not is_invalid:
-            _bulk_save_search_entries(list(chain.from_iterable(engine._update_obj_index_iter(obj) for engine, obj in tasks)))
+        if is_index_queue_enabled():
+            _queue_search_entries(tasks)
+        else:
+            # Reload the objects in bulk, skipping any that have since been deleted.
+            object_ids = defaultdict(list)
+            for engine, model, pk in tasks:
+                object_ids[(engine, model)].append(pk)
+            _bulk_save_search_entries(chain.from_iterable(
+                engine._update_objs_index_iter(engine._load_objs_iter(model, object_id_list))
+                for (engine, model), object_id_list in object_ids.items()
+            ))
     
     # Context management.
             
@@ -255,6 +891,7 @@ class SearchContextManager(local):
         """
         while self.is_active():
             self.end()
+        self._end_pending_flush()
             
             
 class SearchContext(object):
@@ -365,6 +1002,7 @@ class SearchEngine(object):
             adapter_cls = type(str("Custom") + adapter_cls.__name__, (adapter_cls,), field_overrides)
         # Perform the registration.
         adapter_obj = adapter_cls(model)
+        adapter_obj._compile()
         self._registered_models[model] = adapter_obj
         # Connect to the signalling framework.
         post_save.connect(self._post_save_receiver, model)
@@ -403,64 +1041,179 @@ class SearchEngine(object):
             model = model,
         ))
     
-    def _get_entries_for_obj(self, obj):
-        """Returns a queryset of entries associate with the given obj."""
-        model = obj.__class__
-        content_type = ContentType.objects.get_for_model(model)
-        object_id = force_text(obj.pk)
-        # Get the basic list of search entries.
-        search_entries = SearchEntry.objects.filter(
-            content_type = content_type,
-            engine_slug = self._engine_slug,
-        )
-        if has_int_pk(model):
-            # Do a fast indexed lookup.
+    def _iter_search_entry_rows(self, obj, live_pks=None):
+        """
+        Yields a search entry for the given object as a plain tuple of SEARCH_ENTRY_COLUMNS,
+        ready to be bulk loaded.
+        
+        If given, live_pks is used to check whether the object is live instead of the adapter.
+        """
+        adapter = self.get_adapter(obj.__class__)
+        compiled = adapter._get_compiled()
+        if compiled.has_int_pk:
             object_id_int = int(obj.pk)
-            search_entries = search_entries.filter(
-                object_id_int = object_id_int,
-            )
         else:
-            # Alas, have to do a slow unindexed lookup.
             object_id_int = None
-            search_entries = search_entries.filter(
-                object_id = object_id,
-            )
-        return object_id_int, search_entries
+        title = adapter.get_title(obj)
+        description = adapter.get_description(obj)
+        content = adapter.get_content(obj)
+        url = adapter.get_url(obj)
+        meta_encoded = json.dumps(adapter.get_meta(obj))
+        yield (
+            self._engine_slug,
+            compiled.get_content_type_id(),
+            force_text(obj.pk),
+            object_id_int,
+            title,
+            description,
+            content,
+            url,
+            meta_encoded,
+            get_content_hash(title, description, content, url, meta_encoded),
+            (adapter.is_live(obj) if live_pks is None else obj.pk in live_pks) if adapter.store_is_live else True,
+        )
+    
+    def _iter_objs_search_entry_rows(self, objs, batch_size=500):
+        """
+        Yields the search entries for the given objects as plain tuples of SEARCH_ENTRY_COLUMNS,
+        checking whether they are live with a single query for each batch of objects.
+        """
+        objs = iter(objs)
+        while True:
+            obj_batch = list(islice(objs, 0, batch_size))
+            if not obj_batch:
+                break
+            live_pks = {}
+            for model in set(obj.__class__ for obj in obj_batch):
+                adapter = self.get_adapter(model)
+                if adapter.store_is_live:
+                    live_pks[model] = adapter.get_live_pks([obj for obj in obj_batch if obj.__class__ is model])
+            for obj in obj_batch:
+                for row in self._iter_search_entry_rows(obj, live_pks.get(obj.__class__)):
+                    yield row
     
     def _update_obj_index_iter(self, obj):
-        """Either updates the given object index, or yields an unsaved search entry."""
-        model = obj.__class__
-        adapter = self.get_adapter(model)
-        content_type = ContentType.objects.get_for_model(model)
-        object_id = force_text(obj.pk)
-        # Create the search entry data.
-        search_entry_data = {
-            "engine_slug": self._engine_slug,
-            "title": adapter.get_title(obj),
-            "description": adapter.get_description(obj),
-            "content": adapter.get_content(obj),
-            "url": adapter.get_url(obj),
-            "meta_encoded": json.dumps(adapter.get_meta(obj)),
-        }
-        # Try to get the existing search entry.
-        object_id_int, search_entries = self._get_entries_for_obj(obj)
-        # Attempt to update the search entries.
-        update_count = search_entries.update(**search_entry_data)
-        if update_count == 0:
-            # This is the first time the entry was created.
-            search_entry_data.update((
-                ("content_type", content_type),
-                ("object_id", object_id),
-                ("object_id_int", object_id_int),
-            ))
-            yield SearchEntry(**search_entry_data)
-        elif update_count > 1:
-            # Oh no! Somehow we've got duplicated search entries!
-            search_entries.exclude(id=search_entries[0].id).delete()
+        """Yields an unsaved search entry for the given object, ready to be upserted."""
+        for row in self._iter_search_entry_rows(obj):
+            yield SearchEntry(**dict(zip(SEARCH_ENTRY_COLUMNS, row)))
+    
+    def _update_objs_index_iter(self, objs):
+        """Yields unsaved search entries for the given objects, ready to be upserted in bulk."""
+        for row in self._iter_objs_search_entry_rows(objs):
+            yield SearchEntry(**dict(zip(SEARCH_ENTRY_COLUMNS, row)))
+    
+    def _load_objs_iter(self, model, object_ids, batch_size=500):
+        """
+        Yields the objects of the given model with the given primary keys, loaded in
+        batches along with their related objects. Missing objects are skipped.
+        
+        Objects are loaded using the base manager, so that objects hidden by the default
+        manager are still indexed.
+        """
+        queryset = self.get_adapter(model).get_index_queryset(model._base_manager.all())
+        object_ids = list(object_ids)
+        for index in range(0, len(object_ids), batch_size):
+            for obj in queryset.in_bulk(object_ids[index:index + batch_size]).values():
+                yield obj
     
     def update_obj_index(self, obj):
         """Updates the search index for the given obj."""
         _bulk_save_search_entries(list(self._update_obj_index_iter(obj)))
+    
+    def update_queryset_index(self, queryset, batch_size=100):
+        """
+        Updates the search index for all objects in the given queryset, loading and
+        saving them in batches.
+        
+        Use this after changing objects in a way that does not send signals, such as
+        QuerySet.update() or bulk_create().
+        """
+        queryset = self.get_adapter(queryset.model).get_index_queryset(queryset)
+        for chunk in _iter_chunks(queryset, batch_size):
+            _bulk_save_search_entries(self._update_objs_index_iter(chunk), batch_size=batch_size)
+    
+    def update_pks_index(self, model, pks, batch_size=100):
+        """
+        Updates the search index for the objects of the given model with the given
+        primary keys, loading and saving them in batches. Missing objects are skipped.
+        """
+        _bulk_save_search_entries(
+            self._update_objs_index_iter(self._load_objs_iter(model, pks, batch_size=batch_size)),
+            batch_size = batch_size,
+        )
+    
+    def delete_pks_index(self, model, pks, batch_size=500):
+        """
+        Deletes the search entries for the objects of the given model with the given
+        primary keys, using a single statement for each batch of primary keys.
+        
+        Use this after deleting objects in a way that does not send signals, such as
+        a raw SQL delete.
+        """
+        # Get the basic list of search entries.
+        search_entries = SearchEntry.objects.filter(
+            content_type = ContentType.objects.get_for_model(model),
+            engine_slug = self._engine_slug,
+        )
+        pks = list(pks)
+        for index in range(0, len(pks), batch_size):
+            pk_batch = pks[index:index + batch_size]
+            if has_int_pk(model):
+                # Do a fast indexed lookup.
+                search_entries.filter(
+                    object_id_int__in = [int(pk) for pk in pk_batch],
+                ).delete()
+            else:
+                # Alas, have to do a slow unindexed lookup.
+                search_entries.filter(
+                    object_id__in = [force_text(pk) for pk in pk_batch],
+                ).delete()
+        invalidate_search_cache((self._engine_slug,))
+    
+    def update_live_index(self, model):
+        """
+        Updates the live flags stored on the search entries of the given model from its live
+        queryset, using one statement to unflag and one to flag search entries, returning the
+        number of search entries changed.
+        
+        Run this periodically for adapters that use store_is_live with a live queryset that
+        depends on the time.
+        """
+        search_entries = SearchEntry.objects.filter(
+            content_type = ContentType.objects.get_for_model(model),
+            engine_slug = self._engine_slug,
+        )
+        live_queryset = self.get_adapter(model).get_live_queryset()
+        if live_queryset is None:
+            update_count = search_entries.filter(
+                is_live = False,
+            ).update(
+                is_live = True,
+            )
+        else:
+            try:
+                live_sql, live_params = _create_object_filter(live_queryset)
+            except EmptyResultSet:
+                live_sql, live_params = "1 = 0", ()
+            update_count = search_entries.filter(
+                is_live = True,
+            ).extra(
+                where = ("NOT ({live_sql})".format(live_sql=live_sql),),
+                params = live_params,
+            ).update(
+                is_live = False,
+            )
+            update_count += search_entries.filter(
+                is_live = False,
+            ).extra(
+                where = (live_sql,),
+                params = live_params,
+            ).update(
+                is_live = True,
+            )
+        if update_count:
+            invalidate_search_cache((self._engine_slug,))
+        return update_count
         
     # Signalling hooks.
             
@@ -468,50 +1221,64 @@ class SearchEngine(object):
         """Signal handler for when a registered model has been saved."""
         if self._search_context_manager.is_active():
             self._search_context_manager.add_to_context(self, instance)
+        elif is_index_queue_enabled():
+            _queue_search_entries(((self, instance.__class__, instance.pk),))
         else:
             self.update_obj_index(instance)
             
     def _pre_delete_receiver(self, instance, **kwargs):
         """Signal handler for when a registered model has been deleted."""
-        _, search_entries = self._get_entries_for_obj(instance)
-        search_entries.delete()
+        if self._search_context_manager.is_active():
+            self._search_context_manager.add_delete_to_context(self, instance)
+        else:
+            self.delete_pks_index(instance.__class__, (instance.pk,))
         
     # Searching.
     
-    def _create_model_filter(self, models):
-        """Creates a filter for the given model/queryset list."""
-        filters = Q()
+    def _create_model_filter(self, models, live_only=False):
+        """
+        Creates a SQL filter for the given model/queryset list, returning a (sql, params)
+        pair, or None if the list is empty.
+        
+        Querysets are compiled into subqueries, so their ids never leave the database. If
+        live_only is set, models whose adapters store the live flag only match live objects.
+        """
+        db_table = connection.ops.quote_name(SearchEntry._meta.db_table)
+        filters = []
+        params = []
+        has_models = False
         for model in models:
-            filter = Q()
+            has_models = True
             # Process querysets.
             if isinstance(model, QuerySet):
                 sub_queryset = model
                 model = model.model
-                queryset = sub_queryset.values_list("pk", flat=True)
-                if has_int_pk(model):
-                    filter &= Q(
-                        object_id_int__in = queryset,
-                    )
-                else:
-                    live_ids = list(queryset)
-                    if live_ids:
-                        filter &= Q(
-                            object_id__in = live_ids,
-                        )
-                    else:
-                        # HACK: There is a bug in Django (https://code.djangoproject.com/ticket/15145) that messes up __in queries when the iterable is empty.
-                        # This bit of nonsense ensures that this aspect of the query will be impossible to fulfill.
-                        filter &= Q(
-                            content_type = ContentType.objects.get_for_model(model).id + 1,
-                        )
+                try:
+                    filter, filter_params = _create_object_filter(sub_queryset)
+                except EmptyResultSet:
+                    # The queryset is empty, so nothing from this model can match.
+                    continue
+            elif live_only and self.is_registered(model) and self.get_adapter(model).store_is_live:
+                filter = "{db_table}.is_live = %s".format(
+                    db_table = db_table,
+                )
+                filter_params = [True]
+            else:
+                filter = None
+                filter_params = []
             # Add the model to the filter.
             content_type = ContentType.objects.get_for_model(model)
-            filter &= Q(
-                content_type = content_type,
-            )
-            # Combine with the other filters.
-            filters |= filter
-        return filters
+            filters.append("({db_table}.content_type_id = %s{filter})".format(
+                db_table = db_table,
+                filter = "" if filter is None else " AND " + filter,
+            ))
+            params.append(content_type.id)
+            params.extend(filter_params)
+        if not has_models:
+            return None
+        if not filters:
+            return "1 = 0", ()
+        return " OR ".join(filters), tuple(params)
     
     def _get_included_models(self, models):
         """Returns an iterable of models and querysets that should be included in the search query."""
@@ -520,14 +1287,90 @@ class SearchEngine(object):
                 yield model
             else:
                 adaptor = self.get_adapter(model)
+                if adaptor.store_is_live:
+                    # Live objects are flagged in the search index.
+                    yield model
+                    continue
                 queryset = adaptor.get_live_queryset()
                 if queryset is None:
                     yield model
                 else:
                     yield queryset.all()
     
-    def search(self, search_text, models=(), exclude=(), ranking=True, backend_name=None):
-        """Performs a search using the given text, returning a queryset of SearchEntry."""
+    def _get_search_cache_key(self, cache, search_text, models, exclude, ranking, backend, candidate_limit):
+        """Returns the cache key for the results of the given search."""
+        def describe_models(models):
+            for model in models:
+                if isinstance(model, QuerySet):
+                    try:
+                        query = force_text(model.query)
+                    except EmptyResultSet:
+                        query = None
+                    yield (model.model._meta.app_label, model.model._meta.object_name, query)
+                else:
+                    yield (model._meta.app_label, model._meta.object_name, None)
+        search_key = json.dumps((
+            self._engine_slug,
+            _get_search_generation(cache, self._engine_slug),
+            " ".join(search_text.lower().split()),
+            list(describe_models(models)),
+            list(describe_models(exclude)),
+            ranking,
+            candidate_limit,
+            backend.__class__.__module__,
+            backend.__class__.__name__,
+        ))
+        return "watson:search:{search_key}".format(
+            search_key = hashlib.sha1(search_key.encode("utf-8")).hexdigest(),
+        )
+    
+    def _get_cached_results(self, queryset, search_text, models, exclude, ranking, backend, candidate_limit):
+        """
+        Returns the (id, watson_rank) pairs of the given search queryset, in order, using
+        the search cache, or None if the search results cannot be cached.
+        """
+        cache = get_search_cache()
+        if cache is None:
+            return None
+        # Uncommitted changes to the search index must not be cached, or read around.
+        _end_dirty_search_engines()
+        if self._engine_slug in _dirty_search_engines.engine_slugs:
+            return None
+        cache_key = self._get_search_cache_key(cache, search_text, models, exclude, ranking, backend, candidate_limit)
+        cached_results = cache.get(cache_key)
+        if cached_results is None:
+            max_results = getattr(settings, "WATSON_SEARCH_CACHE_MAX_RESULTS", 1000)
+            if ranking:
+                cached_results = list(queryset.values_list("id", "watson_rank")[:max_results + 1])
+            else:
+                cached_results = [(pk, None) for pk in queryset.order_by("id").values_list("id", flat=True)[:max_results + 1]]
+            # Do not cache very broad searches, but remember that they are too broad, so that
+            # they are not run twice every time.
+            if len(cached_results) > max_results:
+                cached_results = False
+            cache.set(cache_key, cached_results, getattr(settings, "WATSON_SEARCH_CACHE_TIMEOUT", 300))
+        if cached_results is False:
+            return None
+        return cached_results
+    
+    def search(self, search_text, models=(), exclude=(), ranking=True, backend_name=None, after=None, count_strategy=None, count_limit=None, candidate_limit=None):
+        """
+        Performs a search using the given text, returning a queryset of SearchEntry.
+        
+        If after is given, it should be a (watson_rank, id) pair taken from a previous
+        search result, and only the results ordered after it are returned.
+        
+        If count_strategy is given, it should be one of "exact", "capped" or "estimate",
+        and is used to count the search results. Capped counts stop at count_limit.
+        
+        If candidate_limit is given, ranking is done in two phases. A cheap first pass picks
+        up to candidate_limit search entries, and only those are ranked. Use
+        is_ranking_truncated() on the results to check whether any matches were left out.
+        
+        If the WATSON_SEARCH_CACHE setting names a cache, the ranked search results are
+        cached until the search index of this engine changes, and iterating over or
+        counting the queryset only fetches the rows required.
+        """
         # Check for blank search text.
         search_text = search_text.strip()
         if not search_text:
@@ -537,18 +1380,50 @@ class SearchEngine(object):
             engine_slug = self._engine_slug,
         )
         # Process the allowed models.
-        queryset = queryset.filter(
-            self._create_model_filter(self._get_included_models(models))
-        ).exclude(
-            self._create_model_filter(exclude)
-        )
+        models = list(self._get_included_models(models))
+        model_filter = self._create_model_filter(models, live_only=True)
+        if model_filter is not None:
+            queryset = queryset.extra(
+                where = (model_filter[0],),
+                params = model_filter[1],
+            )
+        exclude_filter = self._create_model_filter(exclude)
+        if exclude_filter is not None:
+            queryset = queryset.extra(
+                where = ("NOT ({sql})".format(sql=exclude_filter[0]),),
+                params = exclude_filter[1],
+            )
         # Perform the backend-specific full text match.
         backend = get_backend(backend_name=backend_name)
         queryset = backend.do_search(self._engine_slug, queryset, search_text)
         # Perform the backend-specific full-text ranking.
         if ranking:
+            if candidate_limit is not None:
+                candidates = queryset
+                queryset = backend.do_search_candidates(self._engine_slug, queryset, search_text, candidate_limit)
+                queryset = queryset._with_candidates(candidates, candidate_limit)
             queryset = backend.do_search_ranking(self._engine_slug, queryset, search_text)
+        # Look up the cached search results.
+        cached_results = self._get_cached_results(queryset, search_text, models, exclude, ranking, backend, candidate_limit)
+        # Seek past the given position in the results.
+        if after is not None:
+            rank, pk = after
+            if ranking:
+                queryset = backend.do_search_seek(self._engine_slug, queryset, search_text, rank, pk)
+                if cached_results is not None:
+                    cached_results = cached_results[bisect_right([(-cached_rank, cached_pk) for cached_pk, cached_rank in cached_results], (-rank, pk)):]
+            else:
+                queryset = queryset.filter(
+                    id__gt = pk,
+                ).order_by("id")
+                if cached_results is not None:
+                    cached_results = [(cached_pk, cached_rank) for cached_pk, cached_rank in cached_results if cached_pk > pk]
         # Return the complete queryset.
+        if cached_results is not None:
+            # The live filters can change without changing the search index, so check them again.
+            queryset = queryset._with_cached_results(cached_results, model_filter)
+        if count_strategy is not None:
+            queryset = queryset.with_count_strategy(count_strategy, count_limit)
         return queryset
         
     def filter(self, queryset, search_text, ranking=True, backend_name=None):
@@ -588,9 +1463,8 @@ def get_backend(backend_name=None):
     if backend_name in _backends_cache:
         return _backends_cache[backend_name]
     # Load the backend class.
-    if not backend_name:
-        backend_name = getattr(settings, "WATSON_BACKEND", "watson.backends.AdaptiveSearchBackend")
-    backend_module_name, backend_cls_name = backend_name.rsplit(".", 1)
+    backend_path = backend_name or getattr(settings, "WATSON_BACKEND", "watson.backends.AdaptiveSearchBackend")
+    backend_module_name, backend_cls_name = backend_path.rsplit(".", 1)
     backend_module = import_module(backend_module_name)
     try:
         backend_cls = getattr(backend_module, backend_cls_name)
@@ -0,0 +1,63 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'SearchIndexBuild'
+        db.create_table('watson_searchindexbuild', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('engine_slug', self.gf('django.db.models.fields.CharField')(default='default', max_length=200)),
+            ('content_type', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['contenttypes.ContentType'])),
+            ('built_at', self.gf('django.db.models.fields.DateTimeField')()),
+        ))
+        db.send_create_signal('watson', ['SearchIndexBuild'])
+
+        # Adding unique constraint on 'SearchIndexBuild', fields ['engine_slug', 'content_type']
+        db.create_unique('watson_searchindexbuild', ['engine_slug', 'content_type_id'])
+
+
+    def backwards(self, orm):
+        
+        # Removing unique constraint on 'SearchIndexBuild', fields ['engine_slug', 'content_type']
+        db.delete_unique('watson_searchindexbuild', ['engine_slug', 'content_type_id'])
+
+        # Deleting model 'SearchIndexBuild'
+        db.delete_table('watson_searchindexbuild')
+
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'watson.searchindexbuild': {
+            'Meta': {'unique_together': "(('engine_slug', 'content_type'),)", 'object_name': 'SearchIndexBuild'},
+            'built_at': ('django.db.models.fields.DateTimeField', [], {}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'engine_slug': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '200'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'watson.searchentry': {
+            'Meta': {'object_name': 'SearchEntry'},
+            'content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'engine_slug': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'meta_encoded': ('django.db.models.fields.TextField', [], {}),
+            'object_id': ('django.db.models.fields.TextField', [], {}),
+            'object_id_int': ('django.db.models.fields.IntegerField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1000'}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '1000', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['watson']
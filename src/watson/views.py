@@ -2,15 +2,40 @@
 
 from __future__ import unicode_literals
 
-import json
+import json, math, base64, binascii
 
 from django.shortcuts import redirect
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.utils import six
 from django.views import generic
 from django.views.generic.list import BaseListView
 
 import watson
+from watson.backends import COUNT_EXACT
+
+
+def encode_cursor(search_result):
+    """Returns an opaque cursor token for the position of the given search result."""
+    position = [getattr(search_result, "watson_rank", None), search_result.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns the (watson_rank, id) position encoded in the given cursor token."""
+    try:
+        rank, pk = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        pk = int(pk)
+        # Integer ranks must still fit in a float, the type of the database column.
+        if isinstance(rank, six.integer_types) and not isinstance(rank, bool):
+            rank = float(rank)
+    except (binascii.Error, TypeError, ValueError, OverflowError):
+        rank = pk = None
+    # The rank is passed to the database, so it must be a finite number, or None for unranked searches.
+    if pk is None or isinstance(rank, bool) or not (rank is None or isinstance(rank, six.integer_types + (float,))) or (isinstance(rank, float) and (math.isinf(rank) or math.isnan(rank))):
+        raise Http404("Invalid cursor: {cursor!r}".format(
+            cursor = cursor,
+        ))
+    return rank, pk
 
 
 class SearchMixin(object):
@@ -37,14 +62,81 @@ class SearchMixin(object):
         """Returns the models to exclude from the query."""
         return self.exclude
     
+    cursor_param = "cursor"
+    
+    def get_cursor_param(self):
+        """Returns the cursor parameter to use in the request GET dictionary."""
+        return self.cursor_param
+    
+    count_strategy = COUNT_EXACT
+    
+    def get_count_strategy(self):
+        """
+        Returns the strategy used to count the search results when paginating.
+        
+        Capped or estimated counts are cheaper, but limit the number of pages, so deep pages
+        should then be reached using the cursor parameter.
+        """
+        return self.count_strategy
+    
+    count_limit = None
+    
+    def get_count_limit(self):
+        """Returns the number of search results after which capped counts stop, or None for the default."""
+        return self.count_limit
+    
+    candidate_limit = None
+    
+    def get_candidate_limit(self):
+        """Returns the number of search results ranked in full by two-phase ranking, or None to rank all of them."""
+        return self.candidate_limit
+    
     def get_queryset(self):
         """Returns the initial queryset."""
-        return watson.search(self.query, models=self.get_models(), exclude=self.get_exclude())
+        return watson.search(
+            self.query,
+            models = self.get_models(),
+            exclude = self.get_exclude(),
+            after = self.after,
+            count_strategy = self.get_count_strategy(),
+            count_limit = self.get_count_limit(),
+            candidate_limit = self.get_candidate_limit(),
+        )
     
     def get_query(self, request):
         """Parses the query from the request."""
         return request.GET.get(self.get_query_param(), "").strip()
     
+    def get_after(self, request):
+        """Parses the position to seek past from the request cursor, or None."""
+        cursor = request.GET.get(self.get_cursor_param())
+        if cursor:
+            return decode_cursor(cursor)
+        return None
+    
+    next_cursor = None
+    
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates the queryset.
+        
+        Requests that include a cursor are paginated by seeking past the cursor position,
+        which avoids ranking and skipping all the preceding results. These have no paginator
+        or page, so are not paginated as far as the template is concerned, and should link
+        to the next page using the next_cursor context variable.
+        """
+        if self.after is None:
+            paginator, page, object_list, is_paginated = super(SearchMixin, self).paginate_queryset(queryset, page_size)
+            if page.has_next():
+                self.next_cursor = encode_cursor(page[-1])
+            return paginator, page, page.object_list, is_paginated
+        # Fetch one extra result to see if there is a next page.
+        object_list = list(queryset[:page_size + 1])
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            self.next_cursor = encode_cursor(object_list[-1])
+        return None, None, object_list, False
+    
     empty_query_redirect = None
     
     def get_empty_query_redirect(self):
@@ -65,6 +157,7 @@ class SearchMixin(object):
         """Generates context variables."""
         context = super(SearchMixin, self).get_context_data(**kwargs)
         context["query"] = self.query
+        context["next_cursor"] = self.next_cursor
         # Process extra context.
         for key, value in six.iteritems(self.get_extra_context()):
             if callable(value):
@@ -75,6 +168,7 @@ class SearchMixin(object):
     def get(self, request, *args, **kwargs):
         """Performs a GET request."""
         self.query = self.get_query(request)
+        self.after = self.get_after(request)
         if not self.query:
             empty_query_redirect = self.get_empty_query_redirect()
             if empty_query_redirect:
@@ -88,6 +182,15 @@ class SearchView(SearchMixin, generic.ListView):
     
     template_name = "watson/search_results.html"
     
+    def get_queryset(self):
+        """
+        Returns the initial queryset, loading the referenced objects in bulk.
+        
+        Paginating the search results evaluates them before they reach the template, so
+        the objects cannot be loaded by the search_results template tag.
+        """
+        return super(SearchView, self).get_queryset().with_objects()
+    
     
 class SearchApiView(SearchMixin, BaseListView):
     
@@ -103,7 +206,8 @@ class SearchApiView(SearchMixin, BaseListView):
                     "url": result.url,
                     "meta": result.meta,
                 } for result in context[self.get_context_object_name(self.get_queryset())]
-            ]
+            ],
+            "next_cursor": context["next_cursor"],
         }).encode("utf-8")
         # Generate the response.
         response = HttpResponse(content, **response_kwargs)